@@ -0,0 +1,174 @@
+import numpy as np
+from Perlin_ND import PerlinND
+
+class Perlin2D(PerlinND):
+# Static 2D noise: a single (Ny, Nx) image over the lattice axes x and y (see PerlinND). Each point blends the
+# 4 corners of its lattice square, so an image costs about half a Perlin3D frame and no time axis is needed.
+
+    axes = ('x', 'y') # Result keys of the derivatives of variant v are v_dx, v_dy
+    warp_shifts = ((0, 0), (5.2, 1.3)) # Domain shifts (x, y) decorrelating the x and y warp fields
+
+    def __init__(self, Nx, Ny, offset = 1/32, dtype = np.float64, observer = None, seed = None, seeds = None,
+                 periods = None, cache_bytes = None, threads = None):
+
+        self.Nx = Nx
+        self.Ny = Ny
+
+        # Tiling periods are (px, py)
+        super().__init__((Nx, Ny), offset, dtype, observer, seed, seeds, periods, cache_bytes, 'perlin', threads)
+
+        self.x_axis, self.y_axis = self.grid_axes
+
+    def gradient_table(self):
+    # Gradient vectors for each hash & 7: the 4 diagonals and the 4 axis directions.
+    # Returns a single group of shape (2, 8): (grad_x, grad_y)
+       g = np.array([[1, 1], [-1, 1], [1, -1], [-1, -1], [1, 0], [-1, 0], [0, 1], [0, -1]])
+
+       return (np.ascontiguousarray(g.T),)
+
+    def gen_Perlin(self, x_in, y_in, seed_index = slice(None), periods = None, gradient = False):
+    # Fundamental perlin noise calculation (see PerlinND._perlin). With gradient, returns (noise, (d/dx, d/dy))
+    # in lattice units from the same evaluation.
+        return self._perlin((x_in, y_in), seed_index, periods, gradient)
+
+    def noise(self, x_in, y_in, seed_index = slice(None), periods = None, gradient = False):
+    # Base noise
+        return self._noise((x_in, y_in), seed_index, periods, gradient)
+
+    # Classic perlin noise at a single frequency
+    # With return_gradient, every *_Perlin method returns (noise, (d/dx, d/dy)) in grid units from the same pass.
+    def classic_Perlin(self, freq_x, freq_y, return_gradient = False):
+
+        self._set_parameters((freq_x, freq_y), gradient = return_gradient)
+
+        return self._result(self._compute_grid(('classic',)), 'classic')
+
+    # Fractal perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude.
+    def fractal_Perlin(self,
+                       ifreq_x, ifreq_y,
+                       octaves = 4,
+                       initial_amplitude = 1,
+                       persistence = 0.5,
+                       lacunarity = 2,
+                       lod = None,
+                       return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._result(self._compute_grid(('fractal',)), 'fractal')
+
+
+    # Turbulent perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude.
+    # to create a "turbulence"-looking field.
+    def turb_Perlin(self,
+                    ifreq_x, ifreq_y,
+                    octaves = 4,
+                    initial_amplitude = 1,
+                    persistence = 0.5,
+                    lacunarity = 2,
+                    lod = None,
+                    return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._result(self._compute_grid(('turb',)), 'turb')
+
+
+    # Ridge perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude
+    # to create a ridge-like peaks within the noise field.
+    def ridge_Perlin(self,
+                     ifreq_x, ifreq_y,
+                     octaves = 4,
+                     initial_amplitude = 1,
+                     persistence = 0.5,
+                     lacunarity = 2,
+                     lod = None,
+                     return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._result(self._compute_grid(('ridge',)), 'ridge')
+
+
+    # Fused multiscale noise: several variants from one noise evaluation per octave, as a dict keyed by variant
+    # (with derivatives under v_dx and v_dy for return_gradient).
+    def multi_Perlin(self,
+                     ifreq_x, ifreq_y,
+                     variants = ('fractal', 'turb', 'ridge'),
+                     octaves = 4,
+                     initial_amplitude = 1,
+                     persistence = 0.5,
+                     lacunarity = 2,
+                     lod = None,
+                     return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._compute_grid(tuple(variants))
+
+
+    # Domain-warped noise: the variant at (x + a * n_x, y + a * n_y), with fractal warp fields at warp_freq
+    # evaluated on warp_resolution and upsampled. report_error sets self.warp_error.
+    def warp_Perlin(self, variant,
+                    freq_x, freq_y,
+                    warp_freq = 2,
+                    warp_amplitude = 0.1,
+                    warp_octaves = 1,
+                    warp_resolution = None,
+                    octaves = 4,
+                    initial_amplitude = 1,
+                    persistence = 0.5,
+                    lacunarity = 2,
+                    lod = None,
+                    report_error = False):
+
+        resolution = (self.Nx, self.Ny) if warp_resolution is None else tuple(warp_resolution)
+        self._check_warp(variant, resolution)
+        errors = self._warp_errors() if report_error else None
+
+        result = self._warp(variant, (freq_x, freq_y), (octaves, initial_amplitude, persistence, lacunarity, lod),
+                            (warp_freq, warp_amplitude, warp_octaves), resolution, errors = errors)
+
+        if report_error:
+            self.warp_error = self._warp_errors(errors, result.size)
+
+        return result
+
+
+    # Noise over a window (rows, cols) of the image, identical to the same slice of the *_Perlin method
+    def window(self, variant,
+               freq_x, freq_y,
+               rows = slice(None),
+               cols = slice(None),
+               octaves = 4,
+               initial_amplitude = 1,
+               persistence = 0.5,
+               lacunarity = 2,
+               lod = None,
+               return_gradient = False):
+
+        index = (rows, cols)
+        self._check_window(index, 'rows and cols')
+
+        self._set_variant(variant, (freq_x, freq_y), octaves, initial_amplitude, persistence, lacunarity, lod,
+                          return_gradient)
+
+        return self._result(self._compute_grid((variant,), index), variant)
+
+
+    # Noise at (M, 2) points (x, y) in grid units, processed in chunks of chunk_size. Returns an (M,) array,
+    # or (n_seeds, M) for several seeds.
+    def sample(self, points, variant,
+               freq_x, freq_y,
+               octaves = 4,
+               initial_amplitude = 1,
+               persistence = 0.5,
+               lacunarity = 2,
+               chunk_size = 2**16):
+
+        return self._sample(points, variant, (freq_x, freq_y), octaves, initial_amplitude, persistence, lacunarity,
+                            chunk_size)
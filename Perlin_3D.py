@@ -1,145 +1,78 @@
+import time
 import numpy as np
+from Perlin_ND import PerlinND
 
-class Perlin3D:
+class Perlin3D(PerlinND):
+# Animated 2D noise: a (Ny, Nx, Nt) stack of frames over the lattice axes x, y and time t (see PerlinND)
+
+    backends = ('perlin', 'simplex')
+    simplex_scale = 32
+    axes = ('x', 'y', 't') # Result keys of the derivatives of variant v are v_dx, v_dy, v_dt
+    time_axis = True
+    warp_shifts = ((0, 0), (5.2, 1.3)) # Domain shifts (x, y) decorrelating the x and y warp fields
+
+    def __init__(self, Nx, Ny, Nt, offset = 1/32, dtype = np.float64, observer = None, seed = None, seeds = None,
+                 periods = None, cache_bytes = None, backend = 'perlin', threads = None):
 
-    def __init__(self, Nx, Ny, Nt, offset = 1/32):
-        
         self.Nx = Nx
         self.Ny = Ny
         self.Nt = Nt
-        
-        # Setup domain
-        self.X, self.Y, self.Z = np.meshgrid(np.linspace(0,1,Nx),
-                                             np.linspace(0,1,Ny),
-                                             np.linspace(0,1,Nt),
-                                             indexing = 'xy')
-    
-        # Setup non-integer offset
-        assert (offset % 1 != 0), 'Offset must not be an integer'
-        self.offset = offset
-    
-        # Set permutation matrix
-        # Original matrix below. Can also use custom: perm_matrix = np.random.permutation(64)
-        self.perm_matrix = np.array([151, 160, 137, 91, 90, 15,
-                      131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23,
-                      190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177, 33,
-                      88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134, 139, 48, 27, 166,
-                      77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244,
-                      102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196,
-                      135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123,
-                      5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42,
-                      223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
-                      129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97, 228,
-                      251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107,
-                      49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254,
-                      138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180])
-        self.bitwise_val = self.perm_matrix.shape[0] - 1
-    
-        self.freq_x = None
-        self.freq_y = None
-        self.freq_t = None
-        
-        self.octaves = None
-        self.persistence = None
-        self.lacunarity = None
-        self.amplitude = None
-
-    def print_parameters(self):
-    # Print perlin noise parameters
-        
-        print('****** Parameters ******')
-        print(f'Resolution (X,Y): ({self.Nx},{self.Ny})')
-        print(f'Number of images: {self.Nz}')
-        print(f'Frequency: {self.frequency}')
-        print(f'Timescale: {self.timescale}')
-
-        if self.octaves is not None:
-            print('* Multiscale parameters *')
-            print(f'Octaves: {self.octaves}')#
-            print(f'Initial frequency: ({self.freq_x},{self.freq_y})')
-            print(f'Initial amplitude: {self.amplitude}')
-            print(f'Lacunarity: {self.lacunarity}')
-            print(f'Persistance: {self.persistence}')
-
-    def fade(self, t):
-    # Fade function
-        return t * t * t * (t * (t * 6 - 15) + 10)
-
-    def lerp(self, t, a, b):
-    # Linear interpolation
-       return a + t * (b - a)
-
-    def grad(self, hash, x, y, z):
-    # Gradient
-       h = hash & 15
-    
+
+        # Tiling periods are (px, py, pt); backend 'perlin' blends 8 cube corners, 'simplex' 4 simplex corners
+        super().__init__((Nx, Ny, Nt), offset, dtype, observer, seed, seeds, periods, cache_bytes, backend, threads)
+
+        self.x_axis, self.y_axis, self.t_axis = self.grid_axes
+
+    def gradient_table(self):
+    # Gradient vectors for each hash & 15, found by applying Ken Perlin's branching gradient selection to the unit axes.
+    # Returns a single group of shape (3, 16): (grad_x, grad_y, grad_z)
+       h = np.arange(16)[:, np.newaxis]
+       x, y, z = np.eye(3)
+
        u = np.where(h < 8, x, y)
        v = np.where(h < 4, y, np.where((h == 12) | (h == 14), x, z))
-    
+
        u = np.where(h & 1 == 0, u, -u)
        v = np.where(h & 2 == 0, v, -v)
-    
-       return u + v
-
-    def gen_Perlin(self, x_in, y_in, z_in):
-    # Fundamental perlin noise calculation
-    
-       # Find unit cube that contains point
-       X = np.floor(x_in).astype(int) & self.bitwise_val # Same as X = np.floor(x).astype(int) % 256
-       Y = np.floor(y_in).astype(int) & self.bitwise_val
-       Z = np.floor(z_in).astype(int) & self.bitwise_val
-    
-       # Find relative x, y, z of point in cube
-       x = x_in - np.floor(x_in)
-       y = y_in - np.floor(y_in)
-       z = z_in - np.floor(z_in)
-    
-       # Compute fade curves for each of x, y, z
-       u = self.fade(x)
-       v = self.fade(y)
-       w = self.fade(z)
-    
-       # Hash coordinates of the 8 cube corners
-       A = self.perm_matrix[X & self.bitwise_val] + Y
-       AA = self.perm_matrix[A & self.bitwise_val] + Z
-       AB = self.perm_matrix[(A + 1) & self.bitwise_val] + Z
-       B = self.perm_matrix[(X + 1) & self.bitwise_val] + Y
-       BA = self.perm_matrix[(B) & self.bitwise_val] + Z
-       BB = self.perm_matrix[(B + 1) & self.bitwise_val] + Z
-    
-       # Add blended results from 8 corners of cube
-       # u interp
-       ulerp1 = self.lerp(u, self.grad(self.perm_matrix[(AA) & self.bitwise_val], x, y, z), self.grad(self.perm_matrix[(BA) & self.bitwise_val], x-1, y, z))
-       ulerp2 = self.lerp(u, self.grad(self.perm_matrix[(AB) & self.bitwise_val], x, y-1, z), self.grad(self.perm_matrix[(BB) & self.bitwise_val], x-1, y-1, z))
-       ulerp3 = self.lerp(u, self.grad(self.perm_matrix[(AA+1) & self.bitwise_val], x, y, z-1), self.grad(self.perm_matrix[(BA+1) & self.bitwise_val], x-1, y, z-1))
-       ulerp4 = self.lerp(u, self.grad(self.perm_matrix[(AB+1) & self.bitwise_val], x, y-1, z-1), self.grad(self.perm_matrix[(BB+1) & self.bitwise_val], x-1, y-1, z-1))
-       # v interp  
-       vlerp1 = self.lerp(v, ulerp1, ulerp2)
-       vlerp2 = self.lerp(v, ulerp3, ulerp4)
-       # w interp  
-       final_result = self.lerp(w, vlerp1, vlerp2)
-    
-       return final_result
+
+       return (np.ascontiguousarray((u + v).T),)
+
+    def _plane_hashes(self, X, dX, Y, dY, seed_index = slice(None)):
+    # Hashes p[p[X] + Y] of the four (x, y) cell edges, for Perlin3DStepper. They do not depend on time, which
+    # _corner_hashes adds. The doubled perm_table takes chained hashes without masking.
+        p = self.perm_table
+        X = self._route_seeds(X, seed_index)
+
+        A = p.take(X) + Y
+        B = p.take(X + dX) + Y
+
+        return p.take(A), p.take(A + dY), p.take(B), p.take(B + dY)
+
+    def _corner_hashes(self, plane, Z):
+    # Hashes (AA, AB, BA, BB) of the cube corners at time lattice coordinate Z
+        return tuple(edge + Z for edge in plane)
+
+    def gen_Perlin(self, x_in, y_in, z_in, seed_index = slice(None), periods = None, gradient = False):
+    # Fundamental perlin noise calculation (see PerlinND._perlin). With gradient, returns (noise, (d/dx, d/dy, d/dz))
+    # in lattice units from the same evaluation.
+        return self._perlin((x_in, y_in, z_in), seed_index, periods, gradient)
+
+    def gen_simplex(self, x_in, y_in, z_in, seed_index = slice(None)):
+    # Simplex noise at the 4 corners of a simplex (see PerlinND._simplex)
+        return self._simplex((x_in, y_in, z_in), seed_index)
+
+    def noise(self, x_in, y_in, z_in, seed_index = slice(None), periods = None, gradient = False):
+    # Base noise of the selected backend (derivatives need the perlin backend)
+        return self._noise((x_in, y_in, z_in), seed_index, periods, gradient)
 
     # Classic perlin noise at a single frequency
-    def classic_Perlin(self, freq_x, freq_y, freq_t):        
-        
-        self.freq_x = freq_x
-        self.freq_y = freq_y
-        self.freq_t = freq_t
-        
-        self.octaves = None
-        self.persistence = None
-        self.lacunarity = None
-        self.amplitude = None
-    
-        X_points = (self.X + self.offset) * freq_x
-        Y_points = (self.Y + self.offset) * freq_y
-        Z_points = (self.Z + self.offset) * freq_t * (self.Nt - 1)
-        
-        noise_result = self.gen_Perlin(X_points, Y_points, Z_points)
-        
-        return noise_result
+    # With return_gradient, every *_Perlin method returns (noise, (d/dx, d/dy, d/dt)) in grid units from the
+    # same pass (perlin backend only).
+    def classic_Perlin(self, freq_x, freq_y, freq_t, return_gradient = False):
+
+        self._set_parameters((freq_x, freq_y, freq_t), gradient = return_gradient)
+
+        return self._result(self._compute_grid(('classic',)), 'classic')
 
     # Fractal perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude.
     def fractal_Perlin(self,
@@ -147,43 +80,14 @@ class Perlin3D:
                       octaves = 4,
                       initial_amplitude = 1,
                       persistence = 0.5,
-                      lacunarity = 2):
-    
-        self.freq_x = ifreq_x
-        self.freq_y = ifreq_y
-        self.freq_t = freq_t
-        self.octaves = octaves   # Number of octaves
-        self.amplitude = initial_amplitude # Initial amplitude at starting octave
-        self.persistence = persistence # Amplitude scaling factor per octave
-        self.lacunarity = lacunarity # Frequency scaling factor per octave
-        
-        X_points = self.X + self.offset
-        Y_points = self.Y + self.offset
-        Z_points = self.Z + self.offset
-     
-        maxValue = 0
-        amplitude = initial_amplitude
-        freq_x = ifreq_x
-        freq_y = ifreq_y
-
-        total_result = np.zeros_like(X_points)
-    
-        for octave in range(octaves):
-        
-            total_result += self.gen_Perlin(X_points * freq_x,
-                                            Y_points * freq_y,
-                                            Z_points * freq_t  * (self.Nt - 1)
-                                            ) * amplitude  
-             
-            amplitude *= persistence
-            freq_x *= lacunarity
-            freq_y *= lacunarity
-
-            maxValue += amplitude
-        
-        total_result /= maxValue
-        
-        return total_result 
+                      lacunarity = 2,
+                      lod = None,
+                      return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._result(self._compute_grid(('fractal',)), 'fractal')
 
 
     # Turbulent perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude.
@@ -193,43 +97,14 @@ class Perlin3D:
                     octaves = 4,
                     initial_amplitude = 1,
                     persistence = 0.5,
-                    lacunarity = 2):
-        
-        self.freq_x = ifreq_x
-        self.freq_y = ifreq_y
-        self.freq_t = freq_t
-        self.octaves = octaves   # Number of octaves
-        self.amplitude = initial_amplitude # Initial amplitude at starting octave
-        self.persistence = persistence # Amplitude scaling factor per octave
-        self.lacunarity = lacunarity # Frequency scaling factor per octave
-    
-        X_points = self.X + self.offset
-        Y_points = self.Y + self.offset
-        Z_points = self.Z + self.offset
-    
-        maxValue = 0
-        amplitude = initial_amplitude
-        freq_x = ifreq_x
-        freq_y = ifreq_y
-        
-        total_result = np.zeros_like(X_points)
-    
-        for octave in range(octaves):
-        
-            total_result += np.abs(self.gen_Perlin(X_points * freq_x,
-                                                   Y_points * freq_y,
-                                                   Z_points * freq_t * (self.Nt - 1)
-                                                   )) * amplitude  
-        
-            amplitude *= persistence
-            freq_x *= lacunarity
-            freq_y *= lacunarity
-
-            maxValue += amplitude
-        
-        total_result /= maxValue
-        
-        return total_result
+                    lacunarity = 2,
+                    lod = None,
+                    return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._result(self._compute_grid(('turb',)), 'turb')
 
 
     # Ridge perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude
@@ -239,45 +114,259 @@ class Perlin3D:
                     octaves = 4,
                     initial_amplitude = 1,
                     persistence = 0.5,
-                    lacunarity = 2):
-    
-        self.freq_x = ifreq_x
-        self.freq_y = ifreq_y
-        self.freq_t = freq_t
-        self.octaves = octaves   # Number of octaves
-        self.amplitude = initial_amplitude # Initial amplitude at starting octave
-        self.persistence = persistence # Amplitude scaling factor per octave
-        self.lacunarity = lacunarity # Frequency scaling factor per octave
-    
-        X_points = self.X + self.offset
-        Y_points = self.Y + self.offset
-        Z_points = self.Z + self.offset
-    
-        maxValue = 0
-        amplitude = initial_amplitude
-        freq_x = ifreq_x
-        freq_y = ifreq_y
-            
-        total_result = np.zeros_like(X_points)
-    
-        for octave in range(octaves):
-        
-            tmp_result = self.gen_Perlin(X_points * freq_x,
-                                         Y_points * freq_y,
-                                         Z_points * freq_t * (self.Nt - 1)
-                                         )  
-        
-            tmp_result = 1 - np.abs(tmp_result)
-            tmp_result *= tmp_result
-        
-            total_result += tmp_result * amplitude
-        
-            amplitude *= persistence
-            freq_x *= lacunarity
-            freq_y *= lacunarity
-            
-            maxValue += amplitude # May not be necessary
-    
-        total_result /= maxValue
-    
-        return total_result
+                    lacunarity = 2,
+                    lod = None,
+                    return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._result(self._compute_grid(('ridge',)), 'ridge')
+
+
+    # Fused multiscale noise: several variants from one noise evaluation per octave, as a dict keyed by variant
+    # (with derivatives under v_dx, v_dy and v_dt for return_gradient).
+    def multi_Perlin(self,
+                     ifreq_x, ifreq_y, freq_t,
+                     variants = ('fractal', 'turb', 'ridge'),
+                     octaves = 4,
+                     initial_amplitude = 1,
+                     persistence = 0.5,
+                     lacunarity = 2,
+                     lod = None,
+                     return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod,
+                             return_gradient)
+
+        return self._compute_grid(tuple(variants))
+
+
+    # Domain-warped noise: the variant at (x + a * n_x, y + a * n_y, t), with fractal warp fields at warp_freq
+    # evaluated on warp_resolution and upsampled. report_error sets self.warp_error.
+    def warp_Perlin(self, variant,
+                    freq_x, freq_y, freq_t,
+                    warp_freq = 2,
+                    warp_amplitude = 0.1,
+                    warp_octaves = 1,
+                    warp_resolution = None,
+                    octaves = 4,
+                    initial_amplitude = 1,
+                    persistence = 0.5,
+                    lacunarity = 2,
+                    lod = None,
+                    report_error = False):
+
+        resolution = (self.Nx, self.Ny) if warp_resolution is None else tuple(warp_resolution)
+        self._check_warp(variant, resolution)
+        errors = self._warp_errors() if report_error else None
+
+        result = self._warp(variant, (freq_x, freq_y, freq_t), (octaves, initial_amplitude, persistence, lacunarity, lod),
+                            (warp_freq, warp_amplitude, warp_octaves), resolution, errors = errors)
+
+        if report_error:
+            self.warp_error = self._warp_errors(errors, result.size)
+
+        return result
+
+
+    # Lazily generate any noise variant as (Ny, Nx) frames or (Ny, Nx, batch_size) blocks, identical to the
+    # corresponding slices of the *_Perlin methods.
+    def iter_frames(self, variant,
+                    freq_x, freq_y, freq_t,
+                    octaves = 4,
+                    initial_amplitude = 1,
+                    persistence = 0.5,
+                    lacunarity = 2,
+                    lod = None,
+                    batch_size = 1):
+
+        assert batch_size >= 1, 'Batch size must be at least 1'
+
+        self._set_variant(variant, (freq_x, freq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod)
+
+        n_blocks = -(-self.Nt // batch_size)
+
+        for i in range(0, self.Nt, batch_size):
+
+            start = time.perf_counter()
+            block = self._compute_grid((variant,), (slice(None), slice(None), slice(i, i + batch_size)))[variant]
+            if self.observer is not None:
+                self.observer.on_slice(i // batch_size, n_blocks, time.perf_counter() - start)
+
+            if batch_size == 1:
+                yield block[..., 0]
+            else:
+                yield block
+
+
+    # Noise over a window (rows, cols, frames) of the grid, identical to the same slice of the *_Perlin method
+    def window(self, variant,
+               freq_x, freq_y, freq_t,
+               rows = slice(None),
+               cols = slice(None),
+               frames = slice(None),
+               octaves = 4,
+               initial_amplitude = 1,
+               persistence = 0.5,
+               lacunarity = 2,
+               lod = None,
+               return_gradient = False):
+
+        index = (rows, cols, frames)
+        self._check_window(index, 'rows, cols and frames')
+
+        self._set_variant(variant, (freq_x, freq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod,
+                          return_gradient)
+
+        return self._result(self._compute_grid((variant,), index), variant)
+
+
+    # Real-time frame stepper for any noise variant (see Perlin3DStepper). t is in grid units (frames are
+    # 1 / (Nt - 1) apart) and is not limited to [0, 1].
+    def stepper(self, variant,
+                freq_x, freq_y, freq_t,
+                octaves = 4,
+                initial_amplitude = 1,
+                persistence = 0.5,
+                lacunarity = 2,
+                lod = None,
+                t = 0):
+
+        assert self.backend == 'perlin', 'The stepper needs the perlin backend'
+
+        self._set_variant(variant, (freq_x, freq_y, freq_t), octaves, initial_amplitude, persistence, lacunarity, lod)
+
+        return Perlin3DStepper(self, variant, t)
+
+
+    # Noise at (M, 3) points (x, y, t) in grid units, processed in chunks of chunk_size. Returns an (M,) array,
+    # or (n_seeds, M) for several seeds.
+    def sample(self, points, variant,
+               freq_x, freq_y, freq_t,
+               octaves = 4,
+               initial_amplitude = 1,
+               persistence = 0.5,
+               lacunarity = 2,
+               chunk_size = 2**16):
+
+        return self._sample(points, variant, (freq_x, freq_y, freq_t), octaves, initial_amplitude, persistence,
+                            lacunarity, chunk_size)
+
+
+class Perlin3DStepper:
+# Frame-by-frame evaluation of one noise variant of a Perlin3D, with the (x, y) work of every octave cached.
+# Frames match iter_frames at the same t up to rounding (~1e-15 in float64).
+
+    def __init__(self, perlin, variant, t = 0):
+
+        self.perlin = perlin
+        self.variant = variant
+        self.t = t
+
+        # Parameters at creation, so that later calls on perlin do not change the animation
+        self.time_scale = perlin.freq_t * (perlin.Nt - 1)
+        self.period_t = perlin.periods[2]
+
+        X, Y, _ = perlin.domain()
+        X_points = X + perlin.offset
+        Y_points = Y + perlin.offset
+
+        # Spatial state of each octave: (x, y) hashes, fractions, fades and amplitude
+        self.octaves = []
+        self.maxValue = 0
+        amplitude = perlin.amplitude
+        freq_x = perlin.freq_x
+        freq_y = perlin.freq_y
+        scale = 1
+
+        for weight in ([1] if variant == 'classic' else perlin.octave_weights):
+
+            if weight > 0: # Octaves skipped by the level-of-detail mode are not evaluated
+                periods = perlin._octave_periods(scale)
+                X_lattice, dX, x, u = perlin._axis(X_points * freq_x, periods[0])
+                Y_lattice, dY, y, v = perlin._axis(Y_points * freq_y, periods[1])
+                amplitude_w = amplitude if variant == 'classic' else amplitude * weight
+                self.octaves.append((perlin._plane_hashes(X_lattice, dX, Y_lattice, dY), x, y, u, v, amplitude_w))
+
+            if variant != 'classic':
+                amplitude *= perlin.persistence
+                freq_x *= perlin.lacunarity
+                freq_y *= perlin.lacunarity
+                scale *= perlin.lacunarity
+
+                self.maxValue += amplitude * weight
+
+        self.cell = None # Time lattice cell (Z, dZ) of the cached terms
+        self.faces = None
+        self.terms = None
+
+    def _face(self, plane, x, y, u, v, Z, z_shift):
+    # (value at z = 0, slope in z) of the noise on the cell face at time lattice coordinate Z, at z = z_shift
+        perlin = self.perlin
+        p = perlin.perm_table
+        lerp = perlin.lerp
+
+        def lerp_lines(t, a, b):
+            return lerp(t, a[0], b[0]), lerp(t, a[1], b[1])
+
+        grad_x, grad_y, grad_z = perlin.grad_tables[0]
+        AA, AB, BA, BB = perlin._corner_hashes(plane, Z)
+        lines = []
+        for hash, x_c, y_c in ((AA, x, y), (BA, x-1, y), (AB, x, y-1), (BB, x-1, y-1)):
+            h = p.take(hash)
+            g_z = grad_z.take(h)
+            lines.append((grad_x.take(h) * x_c + grad_y.take(h) * y_c - g_z * z_shift, g_z))
+
+        return lerp_lines(v, lerp_lines(u, lines[0], lines[1]), lerp_lines(u, lines[2], lines[3]))
+
+    def _cache_cell(self, Z, dZ):
+    # Faces and (c, s, dc, ds, amplitude) terms of each octave in time lattice cell Z. Stepping forward into the
+    # next cell, its first face is the second face of the current one, moved to z - 1.
+        next_Z = Z + dZ
+        forward = self.cell is not None and int(Z) == self.cell[2]
+
+        faces = []
+        for octave, (plane, x, y, u, v, amplitude) in enumerate(self.octaves):
+            if forward:
+                c, s = self.faces[octave][1]
+                face1 = (c + s, s)
+            else:
+                face1 = self._face(plane, x, y, u, v, Z, 0)
+            faces.append((face1, self._face(plane, x, y, u, v, next_Z, 1)))
+
+        self.faces = faces
+        self.terms = [(face1[0], face1[1], face2[0] - face1[0], face2[1] - face1[1], octave[5])
+                      for (face1, face2), octave in zip(faces, self.octaves)]
+
+        if self.variant == 'fractal': # Octaves add linearly: fold them into one set of terms
+            self.terms = [tuple(sum(terms[k] * terms[4] for terms in self.terms) / self.maxValue for k in range(4))
+                          + (None,)]
+
+        self.cell = (int(Z), int(dZ), int(next_Z) & self.perlin.bitwise_val)
+
+    def frame(self):
+    # (Ny, Nx) frame at the current time (with a leading seed axis if there are several seeds)
+        perlin = self.perlin
+        variant = self.variant
+
+        Z_points = (np.asarray(self.t, dtype = perlin.dtype) + perlin.offset) * self.time_scale
+        Z, dZ, z, w = perlin._axis(Z_points, self.period_t)
+
+        if self.cell is None or self.cell[:2] != (int(Z), int(dZ)):
+            self._cache_cell(Z, dZ)
+
+        if variant in ('classic', 'fractal'):
+            c, s, dc, ds, _ = self.terms[0]
+            return (c + z * s + w * (dc + z * ds))[..., 0]
+
+        results = {variant: np.zeros(self.terms[0][0].shape, dtype = perlin.dtype)}
+        for octave, (c, s, dc, ds, amplitude) in enumerate(self.terms):
+            perlin._add_octave(results, (variant,), octave, c + z * s + w * (dc + z * ds), amplitude)
+
+        return (results[variant] / self.maxValue)[..., 0]
+
+    def next_frame(self, dt):
+    # Advance time by dt and return the frame there
+        self.t += dt
+        return self.frame()
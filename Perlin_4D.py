@@ -1,175 +1,260 @@
+import os
+import time
+import weakref
 import numpy as np
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from store import ChunkedVolume, chunk_grid, save_chunk, write_index
+from Perlin_ND import PerlinND
 
-class Perlin4D:
 
-    def __init__(self, Nx, Ny, Nz, Nt, offset = 1/32):
+# Per-process state of the parallel slice workers, set once by _init_worker
+_worker_state = None
+
+def _open_target(target):
+# Open a shared output volume described by target, returning (array, shared memory block or None)
+    if target[0] == 'path':
+        return np.load(target[1], mmap_mode = 'r+'), None
+
+    shm = SharedMemory(name = target[1]) # Pool children share the parent's resource tracker
+    return np.ndarray(target[2], dtype = target[3], buffer = shm.buf, order = 'F'), shm
+
+def _init_worker(perlin, variants, targets):
+# Open the shared output volumes once per worker process
+    global _worker_state
+
+    opened = {v: _open_target(target) for v, target in targets.items()}
+    _worker_state = (perlin, variants, opened)
+
+def _fill_slice(i):
+# Compute time slice i in a worker and write it straight into the shared outputs. Returns (i, seconds)
+    perlin, variants, opened = _worker_state
+
+    start = time.perf_counter()
+    results = perlin._compute_slice(variants, i)
+    for v, (output, _) in opened.items():
+        output[..., i] = results[v]
+        if isinstance(output, np.memmap):
+            output.flush()
+
+    return i, time.perf_counter() - start
+
+def _write_chunk(path, position, index, compressed):
+# Compute the chunk of the volume at grid index (rows, cols, layers, frames) in a worker and save it to the
+# chunked store at path. Returns (position, seconds)
+    perlin, variants, _ = _worker_state
+
+    start = time.perf_counter()
+    results = perlin._compute_window(variants, index)
+    save_chunk(path, position, results[variants[0]], compressed)
+
+    return position, time.perf_counter() - start
+
+
+class Perlin4D(PerlinND):
+# Animated 3D noise: a (Ny, Nx, Nz, Nt) volume over the lattice axes x, y, z and time t (see PerlinND), generated
+# one time slice at a time into memory, a user array or a .npy memmap, optionally in parallel processes
+
+    backends = ('perlin', 'simplex')
+    simplex_scale = 27
+    axes = ('x', 'y', 'z', 't') # Result keys of the derivatives of variant v are v_dx, v_dy, v_dz, v_dt
+    time_axis = True
+    warp_shifts = ((0, 0, 0), (5.2, 1.3, 2.8), (1.7, 9.2, 4.1)) # Domain shifts (x, y, z) decorrelating the warp fields
+
+    def __init__(self, Nx, Ny, Nz, Nt, offset = 1/32, dtype = np.float64, observer = None, seed = None, seeds = None,
+                 periods = None, cache_bytes = None, backend = 'perlin', threads = None):
 
         self.Nx = Nx
         self.Ny = Ny
         self.Nz = Nz
         self.Nt = Nt
-        
-        # Setup domain
-        self.X, self.Y, self.Z = np.meshgrid(np.linspace(0,1,Nx),
-                                             np.linspace(0,1,Ny),
-                                             np.linspace(0,1,Nz),
-                                             indexing = 'xy')
-
-        self.W = np.linspace(0,1,Nt)
-
-        # Setup non-integer offset
-        assert (offset % 1 != 0), 'Offset must not be an integer'
-        self.offset = offset
-
-        # Set permutation matrix
-        # Original matrix below. Can also use custom: perm_matrix = np.random.permutation(64)
-        self.perm_matrix = np.array([151, 160, 137, 91, 90, 15,
-                      131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23,
-                      190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177, 33,
-                      88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134, 139, 48, 27, 166,
-                      77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244,
-                      102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196,
-                      135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123,
-                      5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42,
-                      223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
-                      129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97, 228,
-                      251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107,
-                      49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254,
-                      138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180])
-        self.bitwise_val = self.perm_matrix.shape[0] - 1
-        
-        self.freq_x = None
-        self.freq_y = None
-        self.freq_z = None
-        self.freq_t = None
-        
-        self.octaves = None
-        self.persistence = None
-        self.lacunarity = None
-        self.amplitude = None
-
-    def print_parameters(self):
-    # Print perlin noise parameters
-    
-        print('****** Parameters ******')
-        print(f'Resolution (X,Y,Z): ({self.Nx},{self.Ny},{self.Nz})')
-        print(f'Number of images: {self.Nt}')
-        print(f'Frequency: {self.freq_x},{self.freq_y},{self.freq_z}')
-        print(f'Timescale: {self.freq_t}')
-        
-        if self.octaves is not None:
-            print('* Multiscale parameters *')
-            print(f'Octaves: {self.octaves}')#
-            print(f'Initial frequency: ({self.freq_x},{self.freq_y})')
-            print(f'Initial amplitude: {self.amplitude}')
-            print(f'Lacunarity: {self.lacunarity}')
-            print(f'Persistance: {self.persistence}')
-
-    def fade(self, t):
-    # Fade function
-       return t * t * t * (t * (t * 6 - 15) + 10)
-
-    def lerp(self, t, a, b):
-    # Linear interpolation
-       return a + t * (b - a)
-
-    def grad(self, hash, x, y, z, w):
-    # Gradient
-       h = hash & 31
+
+        # Tiling periods are (px, py, pz, pt); backend 'perlin' blends 16 hypercube corners, 'simplex' 5 simplex
+        # corners. Use instrumentation.ProgressBar() as observer for a tqdm progress bar over the time slices.
+        super().__init__((Nx, Ny, Nz, Nt), offset, dtype, observer, seed, seeds, periods, cache_bytes, backend, threads)
+
+        self.x_axis, self.y_axis, self.z_axis, self.W = self.grid_axes
+
+    def gradient_table(self):
+    # Gradient vectors for each hash & 31, with the u + v pair and the c term kept apart so grad() sums them in
+    # the original order. Returns (grad_uv, grad_c), each of shape (4, 32)
+       h = np.arange(32)[:, np.newaxis]
+       x, y, z, w = np.eye(4)
+
        u = np.where(h >> 3 == 1, y, np.where(h >> 3 == 2, w, np.where(h >> 3 == 3, z, x)))
        v = np.where(h >> 3 == 1, z, np.where(h >> 3 == 2, x, np.where(h >> 3 == 3, w, y)))
        c = np.where(h >> 3 == 1, w, np.where(h >> 3 == 2, y, np.where(h >> 3 == 3, x, z)))
-       
+
        u_term = np.where(h & 4 == 0, u, -u)
        v_term = np.where(h & 2 == 0, v, -v)
        c_term = np.where(h & 1 == 0, c, -c)
-       
-       return u_term + v_term + c_term
+
+       return np.ascontiguousarray((u_term + v_term).T), np.ascontiguousarray(c_term.T)
+
+    def _ridge_term(self, abs_result, amplitude, sign = None):
+    # The 4D ridge term has always scaled the noise by the amplitude inside: (1 - |n * a|)^2 * a
+        ridge_result = 1 - np.abs(abs_result * amplitude)
+        slope = None if sign is None else -2 * ridge_result * sign * abs(amplitude) * amplitude
+        return ridge_result, slope
 
     # Fundamental perlin noise calculation
-    def gen_Perlin(self, x_in, y_in, z_in, w_in):
-    
-       X = np.floor(x_in).astype(int) & self.bitwise_val # Same as X = np.floor(x).astype(int) % 256
-       Y = np.floor(y_in).astype(int) & self.bitwise_val
-       Z = np.floor(z_in).astype(int) & self.bitwise_val
-       W = np.floor(w_in).astype(int) & self.bitwise_val
-       
-       x = x_in - np.floor(x_in)
-       y = y_in - np.floor(y_in)
-       z = z_in - np.floor(z_in)
-       w = w_in - np.floor(w_in)
-    
-       a = self.fade(x)
-       b = self.fade(y)
-       c = self.fade(z)
-       d = self.fade(w)
-    
-       A = self.perm_matrix[X & self.bitwise_val] + Y
-       B = self.perm_matrix[(X + 1) & self.bitwise_val] + Y
-       AA = self.perm_matrix[A & self.bitwise_val] + Z
-       AB = self.perm_matrix[(A + 1) & self.bitwise_val] + Z
-       BA = self.perm_matrix[B & self.bitwise_val] + Z
-       BB = self.perm_matrix[(B + 1) & self.bitwise_val] + Z
-    
-       AAA = self.perm_matrix[AA & self.bitwise_val] + W
-       AAB = self.perm_matrix[(AA + 1) & self.bitwise_val] + W
-       ABA = self.perm_matrix[AB & self.bitwise_val] + W
-       ABB = self.perm_matrix[(AB + 1) & self.bitwise_val] + W
-       BAA = self.perm_matrix[BA & self.bitwise_val] + W
-       BAB = self.perm_matrix[(BA + 1) & self.bitwise_val] + W
-       BBA = self.perm_matrix[BB & self.bitwise_val] + W
-       BBB = self.perm_matrix[(BB + 1) & self.bitwise_val] + W
-    
-       alerp1 = self.lerp(a, self.grad(self.perm_matrix[AAA & self.bitwise_val], x, y, z, w), self.grad(self.perm_matrix[BAA & self.bitwise_val], x - 1, y, z, w))
-       alerp2 = self.lerp(a, self.grad(self.perm_matrix[ABA & self.bitwise_val], x, y - 1, z, w), self.grad(self.perm_matrix[BBA & self.bitwise_val], x - 1, y - 1, z, w))
-       alerp3 = self.lerp(a, self.grad(self.perm_matrix[AAB & self.bitwise_val], x, y, z - 1, w), self.grad(self.perm_matrix[BAB & self.bitwise_val], x - 1, y, z - 1, w))
-       alerp4 = self.lerp(a, self.grad(self.perm_matrix[ABB & self.bitwise_val], x, y - 1, z - 1, w), self.grad(self.perm_matrix[BBB & self.bitwise_val], x - 1, y - 1, z - 1, w))
-       alerp5 = self.lerp(a, self.grad(self.perm_matrix[(AAA + 1) & self.bitwise_val], x, y, z, w - 1), self.grad(self.perm_matrix[(BAA + 1) & self.bitwise_val], x - 1, y, z, w - 1))
-       alerp6 = self.lerp(a, self.grad(self.perm_matrix[(ABA + 1) & self.bitwise_val], x, y - 1, z, w - 1), self.grad(self.perm_matrix[(BBA + 1) & self.bitwise_val], x - 1, y - 1, z, w - 1))
-       alerp7 = self.lerp(a, self.grad(self.perm_matrix[(AAB + 1) & self.bitwise_val], x, y, z - 1, w - 1), self.grad(self.perm_matrix[(BAB + 1) & self.bitwise_val], x - 1, y, z - 1, w - 1))
-       alerp8 = self.lerp(a, self.grad(self.perm_matrix[(ABB + 1) & self.bitwise_val], x, y - 1, z - 1, w - 1), self.grad(self.perm_matrix[(BBB + 1) & self.bitwise_val], x - 1, y - 1, z - 1, w - 1))
-       
-       blerp1 = self.lerp(b, alerp1, alerp2)
-       blerp2 = self.lerp(b, alerp3, alerp4)
-       blerp3 = self.lerp(b, alerp5, alerp6)
-       blerp4 = self.lerp(b, alerp7, alerp8)
-       
-       clerp1 = self.lerp(c, blerp1, blerp2)
-       clerp2 = self.lerp(c, blerp3, blerp4)
-       
-       dlerp = self.lerp(d, clerp1, clerp2)
-           
-       return dlerp
+    def gen_Perlin(self, x_in, y_in, z_in, w_in, seed_index = slice(None), periods = None, gradient = False):
+    # See PerlinND._perlin. With gradient, returns (noise, (d/dx, d/dy, d/dz, d/dw)) in lattice units from the
+    # same evaluation.
+        return self._perlin((x_in, y_in, z_in, w_in), seed_index, periods, gradient)
+
+    def gen_simplex(self, x_in, y_in, z_in, w_in, seed_index = slice(None)):
+    # Simplex noise at the 5 corners of a simplex (see PerlinND._simplex)
+        return self._simplex((x_in, y_in, z_in, w_in), seed_index)
+
+    def noise(self, x_in, y_in, z_in, w_in, seed_index = slice(None), periods = None, gradient = False):
+    # Base noise of the selected backend (derivatives need the perlin backend)
+        return self._noise((x_in, y_in, z_in, w_in), seed_index, periods, gradient)
+
+    def _compute_slice(self, variants, i, index = (slice(None),) * 3):
+    # Results of variants on time slice i of the volume, or on the spatial window index of it (slices of the rows,
+    # columns and layers), using the stored parameters
+        results = self._compute_grid(variants, tuple(index) + (slice(i, i + 1),))
+        return {v: r[..., 0] for v, r in results.items()}
+
+    def _compute_window(self, variants, index):
+    # In-memory results of variants over the window index (rows, cols, layers, frames), one time slice at a time
+    # so the temporaries stay the size of a slice. Frames of a periodic time axis repeat the first period of slices.
+        frame_indices = range(self.Nt)[index[3]]
+
+        final_results = {}
+        for i, frame in enumerate(frame_indices):
+            results = self._compute_slice(variants, frame, index[:3])
+            for v, result in results.items():
+                if v not in final_results:
+                    final_results[v] = np.empty(result.shape + (len(frame_indices),), dtype = self.dtype)
+                final_results[v][..., i] = result
+
+        return final_results
+
+    def _output_shape(self):
+    # Shape of an output volume, with a leading seed axis for several seeds
+        return self.grid_shape if self.n_seeds is None else (self.n_seeds,) + self.grid_shape
+
+    def _allocate_output(self, out, output_path):
+    # Output volume: a user array, a new .npy memmap on disk or an in-memory array
+
+        shape = self._output_shape()
+
+        assert out is None or output_path is None, 'Give either out or output_path, not both'
+
+        if out is not None:
+            assert out.shape == shape, f'Output must have shape {shape}'
+            return out
+
+        if output_path is not None:
+            # Fortran order keeps each time slice contiguous on disk
+            return np.lib.format.open_memmap(output_path, mode = 'w+', dtype = self.dtype,
+                                             shape = shape, fortran_order = True)
+
+        return np.zeros(shape, dtype = self.dtype)
+
+    def _generate(self, variants, outs, output_paths, workers = 1):
+    # Fill the output of each variant one time slice at a time. outs and output_paths map variants to
+    # the out / output_path arguments. Returns a dict of results keyed by variant.
+
+        assert all(v in self.variants for v in variants), f'Invalid variants: {variants}. Must be from {self.variants}.'
+
+        # Parallel in-memory results are allocated in shared memory by _generate_parallel instead
+        final_results = {}
+        for v in self._outputs(variants):
+            out, output_path = outs.get(v), output_paths.get(v)
+            in_memory = out is None and output_path is None
+            final_results[v] = None if workers > 1 and in_memory else self._allocate_output(out, output_path)
+
+        # With a periodic time axis covering more than one period, only the first period of slices is computed
+        n_slices = self._tile_length(self.periods[3], self.freq_t, self.Nt) or self.Nt
+
+        if workers > 1:
+            self._generate_parallel(variants, final_results, output_paths, n_slices, workers)
+        else:
+            self._generate_serial(variants, final_results, n_slices)
+
+        for final_result in final_results.values():
+            for i in range(n_slices, self.Nt):
+                final_result[..., i] = final_result[..., i % n_slices]
+            if n_slices < self.Nt and isinstance(final_result, np.memmap):
+                final_result.flush()
+
+        return final_results
+
+    def _generate_serial(self, variants, final_results, n_slices):
+    # Compute the first n_slices time slices in this process
+
+        for i in range(n_slices):
+
+            start = time.perf_counter()
+            results = self._compute_slice(variants, i)
+
+            for v, final_result in final_results.items():
+                final_result[..., i] = results[v]
+
+                # Flush finished slices so they survive an interrupted run
+                if isinstance(final_result, np.memmap):
+                    final_result.flush()
+
+            if self.observer is not None:
+                self.observer.on_slice(i, n_slices, time.perf_counter() - start)
+
+    def _generate_parallel(self, variants, final_results, output_paths, n_slices, workers):
+    # Distribute time slices over a process pool writing into the memmap at output_path or shared memory. An
+    # in-memory result (None in final_results) is the shared block itself, closed once the array is released.
+
+        shms = {}
+        blocks = []
+        targets = {}
+        try:
+            for v, final_result in final_results.items():
+                if output_paths.get(v) is not None:
+                    targets[v] = ('path', output_paths[v])
+                    continue
+
+                shape = self._output_shape()
+                shm = SharedMemory(create = True, size = int(np.prod(shape)) * self.dtype.itemsize)
+                blocks.append(shm)
+                targets[v] = ('shm', shm.name, shape, self.dtype)
+                if final_result is None:
+                    final_results[v] = np.ndarray(shape, dtype = self.dtype, buffer = shm.buf, order = 'F')
+                    weakref.finalize(final_results[v], shm.close)
+                else:
+                    shms[v] = shm
+
+            with ProcessPoolExecutor(max_workers = workers,
+                                     initializer = _init_worker,
+                                     initargs = (self, variants, targets)) as executor:
+                # map yields in slice order, so progress and completion are deterministic
+                for i, seconds in executor.map(_fill_slice, range(n_slices)):
+                    if self.observer is not None:
+                        self.observer.on_slice(i, n_slices, seconds)
+
+            for v, shm in shms.items():
+                final_result = final_results[v]
+                final_result[...] = np.ndarray(final_result.shape, dtype = self.dtype, buffer = shm.buf, order = 'F')
+                if isinstance(final_result, np.memmap):
+                    final_result.flush()
+        finally:
+            for shm in shms.values():
+                shm.close()
+            for shm in blocks: # The mappings of shared results stay valid after unlinking
+                shm.unlink()
 
     # Classic perlin noise at a single frequency
-    def classic_Perlin(self, freq_x, freq_y, freq_z, freq_t):
-    
-        self.freq_x = freq_x
-        self.freq_y = freq_y
-        self.freq_z = freq_z
-        self.freq_t = freq_t
-        
-        self.octaves = None
-        self.persistence = None
-        self.lacunarity = None
-        self.amplitude = None
-        
-        X_points = (self.X + self.offset) * freq_x
-        Y_points = (self.Y + self.offset) * freq_y
-        Z_points = (self.Z + self.offset) * freq_z
-        W_seq = (self.W + self.offset) * freq_t * (self.Nt - 1)
-
-        final_result = np.zeros((self.Ny,self.Nx,self.Nz,self.Nt))
-    
-        for i, w in tqdm(enumerate(W_seq)):
-     
-            W_points = np.ones_like(X_points) * w
-     
-            result = self.gen_Perlin(X_points, Y_points, Z_points, W_points)
-            final_result[:,:,:,i] = result
-        
-        return final_result
+    # Results are written to out or to a .npy memmap at output_path, one time slice at a time (workers > 1 in
+    # parallel processes). With return_gradient, every *_Perlin method returns (noise, (d/dx, d/dy, d/dz, d/dt)).
+    def classic_Perlin(self, freq_x, freq_y, freq_z, freq_t,
+                       out = None,
+                       output_path = None,
+                       workers = 1,
+                       return_gradient = False):
+
+        self._set_parameters((freq_x, freq_y, freq_z, freq_t), gradient = return_gradient)
+
+        return self._result(self._generate(('classic',), {'classic': out}, {'classic': output_path}, workers), 'classic')
     
 
     # Fractal perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude.
@@ -178,54 +263,17 @@ class Perlin4D:
                        octaves = 4,
                        initial_amplitude = 1,
                        persistence = 0.5,
-                       lacunarity = 2):
-
-        self.freq_x = ifreq_x
-        self.freq_y = ifreq_y
-        self.freq_z = ifreq_z
-        self.freq_t = freq_t
-        self.octaves = octaves   # Number of octaves
-        self.amplitude = initial_amplitude # Initial amplitude at starting octave
-        self.persistence = persistence # Amplitude scaling factor per octave
-        self.lacunarity = lacunarity # Frequency scaling factor per octave
-        
-        X_points = (self.X + self.offset) 
-        Y_points = (self.Y + self.offset) 
-        Z_points = (self.Z + self.offset) 
-        W_seq = (self.W + self.offset) * freq_t * (self.Nt - 1)
-        
-        final_result = np.zeros((self.Ny,self.Nx,self.Nz,self.Nt))
-
-        for i, w in tqdm(enumerate(W_seq)):
-
-            maxValue = 0
-            W_points = np.ones_like(X_points) * w
-
-            result = np.zeros_like(X_points)
-
-            amplitude = initial_amplitude
-            freq_x = ifreq_x
-            freq_y = ifreq_y
-            freq_z = ifreq_z
-
-            for octave in range(octaves):
-
-                result += self.gen_Perlin(X_points * freq_x,
-                                          Y_points * freq_y,
-                                          Z_points * freq_z,
-                                          W_points) * amplitude
-
-                amplitude *= persistence
-                freq_x *= lacunarity
-                freq_y *= lacunarity
-                freq_z *= lacunarity
-
-                maxValue += amplitude
-                
-            result /= maxValue
-            final_result[:,:,:,i] = result
+                       lacunarity = 2,
+                       lod = None,
+                       out = None,
+                       output_path = None,
+                       workers = 1,
+                       return_gradient = False):
 
-        return final_result
+        self._set_parameters((ifreq_x, ifreq_y, ifreq_z, freq_t), octaves, initial_amplitude, persistence, lacunarity,
+                             lod, return_gradient)
+
+        return self._result(self._generate(('fractal',), {'fractal': out}, {'fractal': output_path}, workers), 'fractal')
 
 
     # Turbulent perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude.
@@ -235,54 +283,17 @@ class Perlin4D:
                     octaves = 4,
                     initial_amplitude = 1,
                     persistence = 0.5,
-                    lacunarity = 2):
-
-        self.freq_x = ifreq_x
-        self.freq_y = ifreq_y
-        self.freq_z = ifreq_z
-        self.freq_t = freq_t
-        self.octaves = octaves   # Number of octaves
-        self.amplitude = initial_amplitude # Initial amplitude at starting octave
-        self.persistence = persistence # Amplitude scaling factor per octave
-        self.lacunarity = lacunarity # Frequency scaling factor per octave
-        
-        X_points = (self.X + self.offset) 
-        Y_points = (self.Y + self.offset) 
-        Z_points = (self.Z + self.offset) 
-        W_seq = (self.W + self.offset) * freq_t * (self.Nt - 1)
-        
-        final_result = np.zeros((self.Ny,self.Nx,self.Nz,self.Nt))
-
-        for i, w in tqdm(enumerate(W_seq)):
-         
-            maxValue = 0
-            W_points = np.ones_like(X_points) * w
-         
-            result = np.zeros_like(X_points)
-        
-            amplitude = initial_amplitude
-            freq_x = ifreq_x
-            freq_y = ifreq_y
-            freq_z = ifreq_z
-            
-            for octave in range(octaves):
-        
-                result += np.abs(self.gen_Perlin(X_points * freq_x,
-                                                 Y_points * freq_y,
-                                                 Z_points * freq_z,
-                                                 W_points)) * amplitude
-                
-                amplitude *= persistence
-                freq_x *= lacunarity   
-                freq_y *= lacunarity        
-                freq_z *= lacunarity        
-
-                maxValue += amplitude
-        
-            result /= maxValue
-            final_result[:,:,:,i] = result
-        
-        return final_result
+                    lacunarity = 2,
+                    lod = None,
+                    out = None,
+                    output_path = None,
+                    workers = 1,
+                    return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, ifreq_z, freq_t), octaves, initial_amplitude, persistence, lacunarity,
+                             lod, return_gradient)
+
+        return self._result(self._generate(('turb',), {'turb': out}, {'turb': output_path}, workers), 'turb')
 
 
     # Ridge perlin noise combines multiple Perlin noise images at increasing frequency and decreasing amplitude
@@ -292,55 +303,164 @@ class Perlin4D:
                      octaves = 4,
                      initial_amplitude = 1,
                      persistence = 0.5,
-                     lacunarity = 2):
-    
-        self.freq_x = ifreq_x
-        self.freq_y = ifreq_y
-        self.freq_z = ifreq_z
-        self.freq_t = freq_t
-        self.octaves = octaves   # Number of octaves
-        self.amplitude = initial_amplitude # Initial amplitude at starting octave
-        self.persistence = persistence # Amplitude scaling factor per octave
-        self.lacunarity = lacunarity # Frequency scaling factor per octave
-        
-        X_points = (self.X + self.offset) 
-        Y_points = (self.Y + self.offset) 
-        Z_points = (self.Z + self.offset) 
-        W_seq = (self.W + self.offset) * freq_t * (self.Nt - 1)
-        
-        final_result = np.zeros((self.Ny,self.Nx,self.Nz,self.Nt))
-
-        for i, w in tqdm(enumerate(W_seq)):
-
-            maxValue = 0
-            W_points = np.ones_like(X_points) * w
-
-            result = np.zeros_like(X_points)
-
-            amplitude = initial_amplitude
-            freq_x = ifreq_x
-            freq_y = ifreq_y
-            freq_z = ifreq_z
-            
-            for octave in range(octaves):
-
-                tmp_result = np.abs(self.gen_Perlin(X_points * freq_x,
-                                                 Y_points * freq_y,
-                                                 Z_points * freq_z,
-                                                 W_points)) * amplitude
-   
-                tmp_result = 1 - np.abs(tmp_result)
-                tmp_result *= tmp_result
-                result += tmp_result * amplitude
-
-                amplitude *= persistence
-                freq_x *= lacunarity
-                freq_y *= lacunarity
-                freq_z *= lacunarity
-
-                maxValue += amplitude
-
-            result /= maxValue
-            final_result[:,:,:,i] = result
+                     lacunarity = 2,
+                     lod = None,
+                     out = None,
+                     output_path = None,
+                     workers = 1,
+                     return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, ifreq_z, freq_t), octaves, initial_amplitude, persistence, lacunarity,
+                             lod, return_gradient)
+
+        return self._result(self._generate(('ridge',), {'ridge': out}, {'ridge': output_path}, workers), 'ridge')
+
+
+    # Fused multiscale noise: several variants from one noise evaluation per octave, as a dict keyed by variant.
+    # out and output_path are optional dicts keyed by variant.
+    def multi_Perlin(self,
+                     ifreq_x, ifreq_y, ifreq_z, freq_t,
+                     variants = ('fractal', 'turb', 'ridge'),
+                     octaves = 4,
+                     initial_amplitude = 1,
+                     persistence = 0.5,
+                     lacunarity = 2,
+                     lod = None,
+                     out = None,
+                     output_path = None,
+                     workers = 1,
+                     return_gradient = False):
+
+        self._set_parameters((ifreq_x, ifreq_y, ifreq_z, freq_t), octaves, initial_amplitude, persistence, lacunarity,
+                             lod, return_gradient)
+
+        return self._generate(tuple(variants), out or {}, output_path or {}, workers)
+
+
+    # Domain-warped noise: the variant at (x + a * n_x, y + a * n_y, z + a * n_z, t), with fractal warp fields
+    # evaluated on warp_resolution and upsampled per time slice. report_error sets self.warp_error.
+    def warp_Perlin(self, variant,
+                    freq_x, freq_y, freq_z, freq_t,
+                    warp_freq = 2,
+                    warp_amplitude = 0.1,
+                    warp_octaves = 1,
+                    warp_resolution = None,
+                    octaves = 4,
+                    initial_amplitude = 1,
+                    persistence = 0.5,
+                    lacunarity = 2,
+                    lod = None,
+                    out = None,
+                    output_path = None,
+                    report_error = False):
+
+        resolution = (self.Nx, self.Ny, self.Nz) if warp_resolution is None else tuple(warp_resolution)
+        final_result = self._allocate_output(out, output_path)
+        self._check_warp(variant, resolution)
+        errors = self._warp_errors() if report_error else None
+
+        for i in range(self.Nt):
+
+            start = time.perf_counter()
+            final_result[..., i] = self._warp(variant, (freq_x, freq_y, freq_z, freq_t),
+                                              (octaves, initial_amplitude, persistence, lacunarity, lod),
+                                              (warp_freq, warp_amplitude, warp_octaves), resolution, slice(i, i + 1),
+                                              errors)[..., 0]
+            if isinstance(final_result, np.memmap):
+                final_result.flush()
+
+            if self.observer is not None:
+                self.observer.on_slice(i, self.Nt, time.perf_counter() - start)
+
+        if report_error: # Maxima and sums of squares were accumulated over the slices
+            self.warp_error = self._warp_errors(errors, final_result.size)
 
         return final_result
+
+
+    # Noise over a window (rows, cols, layers, frames) of the volume, identical to the same slice of the
+    # *_Perlin method
+    def window(self, variant,
+               freq_x, freq_y, freq_z, freq_t,
+               rows = slice(None),
+               cols = slice(None),
+               layers = slice(None),
+               frames = slice(None),
+               octaves = 4,
+               initial_amplitude = 1,
+               persistence = 0.5,
+               lacunarity = 2,
+               lod = None,
+               return_gradient = False):
+
+        index = (rows, cols, layers, frames)
+        self._check_window(index, 'rows, cols, layers and frames')
+
+        self._set_variant(variant, (freq_x, freq_y, freq_z, freq_t), octaves, initial_amplitude, persistence, lacunarity,
+                          lod, return_gradient)
+
+        return self._result(self._compute_window((variant,), index), variant)
+
+
+    # Generate a variant into a chunked store at path (see store.ChunkedVolume) of chunks = (rows, cols, layers,
+    # frames) samples, optionally in parallel processes. Returns the lazy reader of the store.
+    def save_chunked(self, path, variant,
+                     freq_x, freq_y, freq_z, freq_t,
+                     octaves = 4,
+                     initial_amplitude = 1,
+                     persistence = 0.5,
+                     lacunarity = 2,
+                     lod = None,
+                     chunks = (64, 64, 64, 16),
+                     compressed = False,
+                     workers = 1):
+
+        assert len(chunks) == 4 and all(c >= 1 for c in chunks), 'Give one chunk size per axis: (rows, cols, layers, frames)'
+
+        self._set_variant(variant, (freq_x, freq_y, freq_z, freq_t), octaves, initial_amplitude, persistence, lacunarity,
+                          lod)
+
+        # The seed axis, if any, is whole in every chunk
+        seed_shape = () if self.n_seeds is None else (self.n_seeds,)
+        os.makedirs(path, exist_ok = True)
+        grid = [((0,) * len(seed_shape) + position, index)
+                for position, index in chunk_grid(self.grid_shape, chunks)]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers = workers,
+                                     initializer = _init_worker,
+                                     initargs = (self, (variant,), {})) as executor:
+                tasks = [executor.submit(_write_chunk, path, position, index, compressed) for position, index in grid]
+                for i, task in enumerate(tasks):
+                    _, seconds = task.result()
+                    if self.observer is not None:
+                        self.observer.on_slice(i, len(grid), seconds)
+        else:
+            for i, (position, index) in enumerate(grid):
+                start = time.perf_counter()
+                save_chunk(path, position, self._compute_window((variant,), index)[variant], compressed)
+                if self.observer is not None:
+                    self.observer.on_slice(i, len(grid), time.perf_counter() - start)
+
+        attrs = {'variant': variant, 'freq_x': freq_x, 'freq_y': freq_y, 'freq_z': freq_z, 'freq_t': freq_t,
+                 'octaves': self.octaves, 'initial_amplitude': self.amplitude, 'persistence': self.persistence,
+                 'lacunarity': self.lacunarity, 'lod': self.lod, 'offset': self.offset, 'backend': self.backend,
+                 'periods': list(self.periods)}
+        write_index(path, seed_shape + self.grid_shape, self.dtype, seed_shape + tuple(chunks),
+                    compressed, ['seed'] * len(seed_shape) + ['y', 'x', 'z', 't'], attrs)
+
+        return ChunkedVolume(path)
+
+
+    # Noise at (M, 4) points (x, y, z, t) in grid units, processed in chunks of chunk_size. Returns an (M,)
+    # array, or (n_seeds, M) for several seeds.
+    def sample(self, points, variant,
+               freq_x, freq_y, freq_z, freq_t,
+               octaves = 4,
+               initial_amplitude = 1,
+               persistence = 0.5,
+               lacunarity = 2,
+               chunk_size = 2**16):
+
+        return self._sample(points, variant, (freq_x, freq_y, freq_z, freq_t), octaves, initial_amplitude, persistence,
+                            lacunarity, chunk_size)
@@ -0,0 +1,799 @@
+import math
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+from instrumentation import StageClock
+
+class PerlinND:
+# Dimension-generic noise engine behind Perlin2D, Perlin3D and Perlin4D. Front-ends declare their axes and
+# gradient_table; the grid has shape (Ny, Nx, ...) with any further axes in lattice order.
+
+    variants = ('classic', 'fractal', 'turb', 'ridge')
+    backends = ('perlin',)
+    simplex_scale = None # Output scale of the simplex backend to about [-1, 1], where the front-end has one
+    axes = () # Lattice axes. Result keys of the derivatives of variant v are v_d<axis>
+    time_axis = False # The last axis is time: its frequency does not scale with the octaves
+    warp_shifts = () # Domain shifts of the spatial axes decorrelating the warp fields, one per spatial axis
+    batch_points = 2**15 # Points per vectorized pass for several seeds or threaded blocks
+
+    def __init__(self, samples, offset = 1/32, dtype = np.float64, observer = None, seed = None, seeds = None,
+                 periods = None, cache_bytes = None, backend = 'perlin', threads = None):
+
+        # Number of samples along each lattice axis
+        self.samples = tuple(samples)
+        assert len(self.samples) == len(self.axes), f'Give one number of samples per axis: {self.axes}'
+
+        # Floating point precision of coordinates, gradients and results (np.float64 or np.float32)
+        self.dtype = np.dtype(dtype)
+        assert self.dtype in (np.float32, np.float64), 'dtype must be np.float32 or np.float64'
+
+        # Instrumentation hooks (see instrumentation.Observer), called with stage, octave and slice timings
+        self.observer = observer
+
+        # Optional LRU cache of finished results (see cache.LRUCache) holding at most cache_bytes, for repeated
+        # calls with the same parameters. Hit, miss and eviction statistics are in self.cache.stats().
+        self.cache = None if cache_bytes is None else LRUCache(cache_bytes)
+
+        # Setup domain. Only the 1D axes are stored (see domain). Grid dimension of each lattice axis
+        self.grid_axes = [np.linspace(0,1,N, dtype = self.dtype) for N in self.samples]
+        self.grid_dims = (1, 0) + tuple(range(2, len(self.samples)))
+        self.grid_shape = tuple(self.samples[self.grid_dims.index(dim)] for dim in range(len(self.samples)))
+
+        # Setup non-integer offset
+        assert (offset % 1 != 0), 'Offset must not be an integer'
+        self.offset = offset
+
+        # Tiling periods in lattice cells at the initial frequencies, None for a non-periodic axis.
+        # Spatial periods scale with the octave frequencies, so the field repeats every px / freq_x in x.
+        periods = (None,) * len(self.axes) if periods is None else tuple(periods)
+        assert len(periods) == len(self.axes), f'Give one period (or None) per axis: {self.axes}'
+        assert all(P is None or (float(P).is_integer() and P > 0) for P in periods), \
+            f'Periods must be None or positive whole numbers of lattice cells, got {periods}'
+        self.periods = tuple(None if P is None else int(P) for P in periods)
+
+        # Base noise: 'perlin' (gen_Perlin, 2**n cell corners) or, where the front-end has one, 'simplex'
+        assert backend in self.backends, f'Invalid backend: {backend}. Must be one of {self.backends}.'
+        assert backend == 'perlin' or all(P is None for P in self.periods), 'Tiling periods need the perlin backend'
+        self.backend = backend
+
+        # Grid evaluation in blocks of rows of about batch_points points on this many threads (NumPy releases the
+        # GIL in its ufuncs). Blocks also bound the size of the temporaries. None evaluates the grid in one pass.
+        assert threads is None or threads >= 1, 'threads must be at least 1'
+        self.threads = threads
+
+        # Set permutation matrix
+        # Original matrix below. Can also use custom: perm_matrix = np.random.permutation(64)
+        perm_matrix = np.array([151, 160, 137, 91, 90, 15,
+                                131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23,
+                                190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177, 33,
+                                88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71, 134, 139, 48, 27, 166,
+                                77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244,
+                                102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196,
+                                135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250, 124, 123,
+                                5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42,
+                                223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
+                                129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97, 228,
+                                251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107,
+                                49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254,
+                                138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180])
+
+        assert seed is None or seeds is None, 'Give either seed or seeds, not both'
+        if seeds is not None: # One permutation per seed, with a leading seed axis on all results
+            perm_matrix = np.stack([self.seed_permutation(s) for s in seeds])
+        elif seed is not None: # Reproducible random permutation (see seed_permutation)
+            perm_matrix = self.seed_permutation(seed)
+
+        self.set_permutation(perm_matrix)
+
+        self.freqs = None
+        for axis in self.axes:
+            setattr(self, f'freq_{axis}', None)
+
+        self.octaves = None
+        self.persistence = None
+        self.lacunarity = None
+        self.amplitude = None
+
+    def __getstate__(self):
+    # Observers and the cache stay in the calling process; worker processes report timings back instead
+        state = self.__dict__.copy()
+        state['observer'] = None
+        state['cache'] = None
+        return state
+
+    def print_parameters(self):
+    # Print perlin noise parameters
+
+        spatial = self.axes[:self.n_spatial]
+        freqs = (None,) * len(self.axes) if self.freqs is None else self.freqs
+
+        print('****** Parameters ******')
+        print(f'Resolution ({",".join(spatial).upper()}): ({",".join(str(N) for N in self.samples[:self.n_spatial])})')
+        if self.time_axis:
+            print(f'Number of images: {self.samples[-1]}')
+        print(f'Frequency: {",".join(str(f) for f in freqs[:self.n_spatial])}')
+        if self.time_axis:
+            print(f'Timescale: {freqs[-1]}')
+
+        if self.octaves is not None:
+            print('* Multiscale parameters *')
+            print(f'Octaves: {self.octaves}')
+            print(f'Initial frequency: ({",".join(str(f) for f in freqs[:self.n_spatial])})')
+            print(f'Initial amplitude: {self.amplitude}')
+            print(f'Lacunarity: {self.lacunarity}')
+            print(f'Persistance: {self.persistence}')
+
+    @property
+    def n_spatial(self):
+    # Number of spatial lattice axes, whose frequencies scale with the octaves
+        return len(self.axes) - self.time_axis
+
+    @staticmethod
+    def seed_permutation(seed, size = 256):
+    # Reproducible random permutation matrix for an integer seed
+        return np.random.default_rng(seed).permutation(size)
+
+    def set_permutation(self, perm_matrix):
+    # Set the permutation matrix and the lookup tables derived from it. A 2D matrix holds one permutation per
+    # row (seed); noise is then generated for all of them at once, with a leading seed axis.
+        self.perm_matrix = np.asarray(perm_matrix)
+        if self.cache is not None: # Cached results belong to the previous permutation
+            self.cache.clear()
+        perms = np.atleast_2d(self.perm_matrix)
+        n_seeds, period = perms.shape
+
+        self.n_seeds = n_seeds if self.perm_matrix.ndim == 2 else None
+        self.bitwise_val = period - 1
+
+        # Doubled table per seed in the narrowest unsigned dtype, so chained hashes need no re-masking. Seed s's
+        # section starts at s * 2 * period and its values are shifted to stay within it.
+        sections = 2 * period * np.arange(n_seeds)
+        self.hash_dtype = np.min_scalar_type(2 * period * n_seeds - 1)
+        self.perm_table = (np.tile(perms, 2) + sections[:, np.newaxis]).ravel().astype(self.hash_dtype)
+        self.seed_offset = None if self.n_seeds is None else sections.astype(self.hash_dtype)
+
+        # Gradient lookup tables indexed directly by hash value (hash & (table size - 1) folded in), one
+        # (n_axes, len(perm_table)) array per group of gradient_table
+        h = np.arange(self.perm_table.shape[0]) % (2 * period)
+        self.grad_tables = tuple(np.ascontiguousarray(g[:, h & (g.shape[1] - 1)], dtype = self.dtype)
+                                 for g in self.gradient_table())
+
+    def gradient_table(self):
+    # Gradient vectors: a tuple of (n_axes, 2**k) groups indexed by hash & (2**k - 1), summed in order by grad
+        raise NotImplementedError
+
+    def lattice(self, floor_in, period = None):
+    # Lattice coordinate of floored points, wrapped to the permutation period, and the step to the next lattice
+    # coordinate (modular in hash_dtype). The step is 1 unless a tiling period wraps the next coordinate back.
+        if period is None:
+            return (floor_in.astype(int) & self.bitwise_val).astype(self.hash_dtype), 1
+
+        assert int(period) <= self.bitwise_val + 1, \
+            f'Period {int(period)} exceeds the permutation size {self.bitwise_val + 1}, so it would repeat inside itself'
+        lattice_in = floor_in.astype(int) % int(period)
+        lattice_next = (lattice_in + 1) % int(period)
+        X = lattice_in & self.bitwise_val
+        return X.astype(self.hash_dtype), ((lattice_next & self.bitwise_val) - X).astype(self.hash_dtype)
+
+    def _route_seeds(self, X, seed_index = slice(None)):
+    # Route each seed's first lookup into its section of perm_table, along a leading seed axis
+        if self.seed_offset is None:
+            return X
+        return X + self.seed_offset[seed_index].reshape((-1,) + (1,) * X.ndim)
+
+    def domain(self):
+    # Separable sampling grid: each lattice axis shaped along its grid dimension, broadcasting to the grid
+        n = len(self.grid_axes)
+        return tuple(axis.reshape([-1 if d == dim else 1 for d in range(n)])
+                     for axis, dim in zip(self.grid_axes, self.grid_dims))
+
+    def fade(self, t):
+    # Fade function
+        return t * t * t * (t * (t * 6 - 15) + 10)
+
+    def fade_derivative(self, t):
+    # Derivative of the fade function
+        return 30 * t * t * (t * (t - 2) + 1)
+
+    def lerp(self, t, a, b):
+    # Linear interpolation
+       return a + t * (b - a)
+
+    def grad(self, hash, *coords):
+    # Gradient as gathered dot products, one per group of gradient_table, summed in order. hash must be a
+    # perm_table value. Every gradient component is 0 or +-1, so the result is exactly that of the branching form.
+       total = None
+       for table in self.grad_tables:
+           term = table[0].take(hash) * coords[0]
+           for component, coord in zip(table[1:], coords[1:]):
+               term = term + component.take(hash) * coord
+           total = term if total is None else total + term
+       return total
+
+    def _slope(self, hash, axis):
+    # Component axis of the gradient of hash, summed over the groups of gradient_table
+       slope = self.grad_tables[0][axis].take(hash)
+       for table in self.grad_tables[1:]:
+           slope = slope + table[axis].take(hash)
+       return slope
+
+    def _axis(self, coord_in, period = None):
+    # Per-axis part of gen_Perlin: lattice coordinate and step to the next one (see lattice), relative position
+    # in the cell and its fade curve
+        coord_in = np.asarray(coord_in, dtype = self.dtype)
+        coord_floor = np.floor(coord_in)
+
+        X, dX = self.lattice(coord_floor, period)
+        x = coord_in - coord_floor
+
+        return X, dX, x, self.fade(x)
+
+    def _perlin(self, coords, seed_index = slice(None), periods = None, gradient = False):
+    # Perlin noise at points coords (one broadcastable array per axis) for the seeds seed_index. With gradient,
+    # returns (noise, per-axis derivatives) in lattice units.
+
+       if periods is None:
+           periods = self.periods
+
+       clock = None if self.observer is None else StageClock(self.observer)
+
+       # Find the lattice cell that contains each point, the relative position in the cell and its fade curves
+       lattice, steps, fractions, fades = zip(*(self._axis(c, P) for c, P in zip(coords, periods)))
+
+       if clock is not None:
+           clock.lap('lattice', *lattice, *fractions, *fades)
+
+       # Hashes of the cell edges along the last axis in corner bit order x + 2y + 4z..., doubled by each axis.
+       # The doubled perm_table takes chained hashes without masking.
+       p = self.perm_table
+       edges = [self._route_seeds(lattice[0], seed_index)]
+       for L, step in zip(lattice[1:], steps):
+           edges = [p.take(e) + L for e in edges] + [p.take(e + step) + L for e in edges]
+
+       grad, lerp = self.grad, self.lerp
+       if clock is not None:
+           clock.lap('hashing', *edges)
+           grad = clock.timed('gradient', grad)
+           lerp = clock.timed('interpolation', lerp)
+
+       # Corner k lies at offset bit j of k along axis j, and its hash is the last lookup of its edge. The blend
+       # below looks the hashes up lazily, one corner at a time.
+       corners = (p.take(e) if dE is None else p.take(e + dE) for dE in (None, steps[-1]) for e in edges)
+       shifted = [(x, x - 1) for x in fractions]
+       offsets = [[s[(k >> j) & 1] for j, s in enumerate(shifted)] for k in range(2 ** len(coords))]
+
+       if gradient:
+           final_result = self._blend_gradient(corners, offsets, fractions, fades)
+       else:
+           # Blend the corner gradients in x, then y, then z...: each pair of partial blends of one level is
+           # merged as soon as both exist, so at most one partial blend per level is alive
+           stack = []
+           for hash, offset in zip(corners, offsets):
+               value = grad(hash, *offset)
+               level = 0
+               while stack and stack[-1][0] == level:
+                   value = lerp(fades[level], stack.pop()[1], value)
+                   level += 1
+               stack.append((level, value))
+           final_result = stack[0][1]
+
+       if clock is not None:
+           clock.lap('gradient')
+
+       return final_result
+
+    def _blend_gradient(self, hashes, offsets, fractions, fades):
+    # Blend of the cell corners of _perlin and its derivatives on the same level stack. Reducing axis k lerps the
+    # gradient components in place and adds the fade derivative times the difference across the cell along k.
+       fade_slopes = [self.fade_derivative(x) for x in fractions]
+
+       stack = []
+       for hash, offset in zip(hashes, offsets):
+           value = self.grad(hash, *offset)
+           slopes = [self._slope(hash, k) for k in range(len(fractions))]
+           level = 0
+           while stack and stack[-1][0] == level:
+               _, a, a_slopes = stack.pop()
+               t = fades[level]
+               for a_k, b_k in zip(a_slopes, slopes): # b_k = lerp(t, a_k, b_k)
+                   b_k -= a_k
+                   b_k *= t
+                   b_k += a_k
+               difference = value - a
+               value = a + t * difference # lerp(t, a, value)
+               difference *= fade_slopes[level]
+               slopes[level] += difference
+               level += 1
+           stack.append((level, value, slopes))
+
+       _, value, slopes = stack[0]
+       return value, tuple(slopes)
+
+    def _simplex(self, coords, seed_index = slice(None)):
+    # Simplex noise (Ken Perlin 2001, after Stefan Gustavson's reference implementation) at points coords: the sum
+    # of radial kernels at the n + 1 corners of the simplex containing each point, with the gradients of grad.
+
+       clock = None if self.observer is None else StageClock(self.observer)
+
+       coords = [np.asarray(c, dtype = self.dtype) for c in coords]
+       n = len(coords)
+
+       # Skew the input space to find the simplex cell, then unskew the cell origin
+       F = (math.sqrt(n + 1) - 1) / n
+       G = (n + 1 - math.sqrt(n + 1)) / (n * (n + 1))
+       s = sum(coords[1:], coords[0]) * F
+       cells = [np.floor(c + s) for c in coords]
+       t = sum(cells[1:], cells[0]) * G
+       origins = [c - (i - t) for c, i in zip(coords, cells)]
+
+       # Rank the coordinates to find which of the n! simplices of the cell contains the point
+       greater = {(a, b): origins[a] > origins[b] for a in range(n) for b in range(a + 1, n)}
+       ranks = []
+       for a in range(n):
+           terms = [~greater[b, a] for b in range(a)] + [greater[a, b] for b in range(a + 1, n)]
+           ranks.append(sum(terms[1:], terms[0].astype(np.int8)))
+
+       lattice = [self.lattice(i)[0] for i in cells]
+       lattice[0] = self._route_seeds(lattice[0], seed_index)
+
+       if clock is not None:
+           clock.lap('lattice', *origins, *ranks, *lattice)
+
+       p = self.perm_table
+
+       def corner_hash(*offsets):
+           hash = lattice[0] + offsets[0]
+           for L, d in zip(lattice[1:], offsets[1:]):
+               hash = p.take(hash) + L + d
+           return p.take(hash)
+
+       grad = self.grad
+       if clock is not None:
+           corner_hash = clock.timed('hashing', corner_hash)
+           grad = clock.timed('gradient', grad)
+
+       # Corner c of the simplex is offset by 1 along the axes of the c highest ranks: corner 0 is the cell
+       # origin and corner n the opposite corner of the cell
+       final_result = np.zeros(np.broadcast_shapes(origins[0].shape, lattice[0].shape), dtype = self.dtype)
+       for c in range(n + 1):
+           if c in (0, n):
+               offsets = [c // n] * n
+           else:
+               offsets = [rank >= n - c for rank in ranks]
+           positions = [x - d + c * G for x, d in zip(origins, offsets)]
+
+           # (0.6 - r^2)^4 kernel, zero beyond r^2 = 0.6
+           falloff = positions[0] * positions[0]
+           for x in positions[1:]:
+               falloff += x * x
+           np.subtract(0.6, falloff, out = falloff)
+           np.maximum(falloff, 0, out = falloff)
+           falloff *= falloff
+           falloff *= falloff
+           final_result += falloff * grad(corner_hash(*offsets), *positions)
+
+       # Scale to about [-1, 1]
+       final_result *= self.simplex_scale
+
+       if clock is not None:
+           clock.lap('interpolation')
+
+       return final_result
+
+    def _noise(self, coords, seed_index = slice(None), periods = None, gradient = False):
+    # Base noise of the selected backend (derivatives need the perlin backend)
+        if self.backend == 'simplex':
+            return self._simplex(coords, seed_index)
+        return self._perlin(coords, seed_index, periods, gradient)
+
+    def _set_parameters(self, freqs,
+                        octaves = None,
+                        initial_amplitude = None,
+                        persistence = None,
+                        lacunarity = None,
+                        lod = None,
+                        gradient = False):
+    # Store the parameters of the noise field being generated. freqs holds the initial frequency of each axis.
+
+        assert len(freqs) == len(self.axes), f'Give one frequency per axis: {self.axes}'
+        assert lod in (None, 'skip', 'fade'), f'Invalid lod: {lod}. Must be one of None, \'skip\', \'fade\'.'
+        assert not gradient or self.backend == 'perlin', 'Derivatives need the perlin backend'
+
+        self.freqs = tuple(freqs)
+        for axis, freq in zip(self.axes, self.freqs):
+            setattr(self, f'freq_{axis}', freq)
+        self.octaves = octaves   # Number of octaves
+        self.amplitude = initial_amplitude # Initial amplitude at starting octave
+        self.persistence = persistence # Amplitude scaling factor per octave
+        self.lacunarity = lacunarity # Frequency scaling factor per octave
+        self.lod = lod # Level-of-detail mode for octaves beyond the sampling limit of the grid
+        self.gradient = gradient # Also compute the derivatives along every axis of every variant
+
+        self.octave_weights = self._octave_weights()
+        self.skipped_octaves = self.octave_weights.count(0) # Octaves not evaluated by the last call
+
+    def _set_variant(self, variant, freqs, octaves, initial_amplitude, persistence, lacunarity, lod = None,
+                     gradient = False):
+    # _set_parameters for one variant: 'classic' is a single octave and ignores the multiscale parameters
+        assert variant in self.variants, f'Invalid variant: {variant}. Must be one of {self.variants}.'
+
+        if variant == 'classic':
+            self._set_parameters(freqs, gradient = gradient)
+        else:
+            self._set_parameters(freqs, octaves, initial_amplitude, persistence, lacunarity, lod, gradient)
+
+    def _outputs(self, variants):
+    # Result keys of variants: each variant, followed by its derivatives if they are computed
+        if not self.gradient:
+            return tuple(variants)
+        return tuple(key for v in variants for key in (v,) + tuple(f'{v}_d{axis}' for axis in self.axes))
+
+    def _result(self, results, variant):
+    # Result of one variant: its array, or (array, derivatives) if they are computed
+        if not self.gradient:
+            return results[variant]
+        return results[variant], tuple(results[f'{variant}_d{axis}'] for axis in self.axes)
+
+    def _compute(self, variants, *coords):
+    # Noise variants at domain points coords (one array per axis in [0, 1]) with the stored parameters, sharing
+    # the base noise of each octave. Returns a dict keyed by variant.
+
+        assert all(v in self.variants for v in variants), f'Invalid variants: {variants}. Must be from {self.variants}.'
+
+        points = [c + self.offset for c in coords]
+        if self.time_axis: # Frames are freq_t lattice cells apart
+            points[-1] = points[-1] * self.freqs[-1] * (self.samples[-1] - 1)
+
+        shape = np.broadcast_shapes(*(np.shape(c) for c in coords))
+
+        if self.n_seeds is None:
+            return self._accumulate(variants, points, shape)
+
+        # Seeds are evaluated in blocks of about batch_points points, each in one vectorized pass. Blocks keep
+        # the temporaries cache-sized; one pass over every seed of a large batch is slower than a loop over seeds.
+        results = {v: np.empty((self.n_seeds,) + shape, dtype = self.dtype) for v in self._outputs(variants)}
+        block = max(1, self.batch_points // max(1, int(np.prod(shape))))
+
+        for start in range(0, self.n_seeds, block):
+            seed_index = slice(start, start + block)
+            for v, result in self._accumulate(variants, points, shape, seed_index).items():
+                results[v][seed_index] = result
+
+        return results
+
+    def _compute_blocks(self, variants, *coords):
+    # _compute over a grid in blocks of rows, run on self.threads threads and written into preallocated results.
+    # Each point goes through exactly the same operations as in a single pass.
+
+        shape = np.broadcast_shapes(*(c.shape for c in coords))
+        n = len(shape)
+        if self.n_seeds is not None:
+            shape = (self.n_seeds,) + shape
+        results = {v: np.empty(shape, dtype = self.dtype) for v in self._outputs(variants)}
+
+        row_points = int(np.prod(shape)) // shape[-n]
+        rows = max(1, self.batch_points // row_points)
+
+        def fill(start):
+            block_coords = list(coords)
+            block_coords[1] = coords[1][start:start + rows] # Rows are the y axis
+            block = self._compute(variants, *block_coords)
+            for v, result in block.items():
+                results[v][(Ellipsis, slice(start, start + rows)) + (slice(None),) * (n - 1)] = result
+
+        with ThreadPoolExecutor(max_workers = self.threads) as executor:
+            list(executor.map(fill, range(0, shape[-n], rows)))
+
+        return results
+
+    def _octave_periods(self, scale):
+    # Lattice periods of an octave at scale times the initial spatial frequencies. freq_t is the same at every
+    # octave, so the time period is too.
+        periods = tuple(None if P is None else P * scale for P in self.periods[:self.n_spatial]) \
+                  + self.periods[self.n_spatial:]
+        assert all(P is None or float(P).is_integer() for P in periods), \
+            f'Periods must be whole numbers of lattice cells at every octave, got {periods}'
+        return tuple(None if P is None else int(P) for P in periods)
+
+    def _octave_weights(self):
+    # Weight of each octave under the level-of-detail mode: octaves beyond 2 samples per cell (Nyquist) are
+    # dropped ('skip') or ramped down from 4 samples per cell ('fade'). The first octave is always kept.
+        if self.octaves is None:
+            return []
+
+        weights = [1]
+        freqs = self.freqs[:self.n_spatial]
+
+        for octave in range(1, self.octaves):
+            freqs = [freq * self.lacunarity for freq in freqs]
+            steps = [freq / (N - 1) for freq, N in zip(freqs, self.samples) if N > 1]
+            step = min(steps, default = 0) # Lattice cells per sample along the finest axis
+
+            if self.lod is None:
+                weights.append(1)
+            elif self.lod == 'skip':
+                weights.append(1 if step <= 0.5 else 0)
+            else:
+                weights.append(float(np.clip((0.5 - step) / 0.25, 0, 1)))
+
+        return weights
+
+    @staticmethod
+    def _upsample(field, axis, n):
+    # Linear interpolation of field along axis from its samples spanning [0, 1] to n samples spanning [0, 1]
+        m = field.shape[axis]
+        if m == n:
+            return field
+        if m == 1:
+            return np.repeat(field, n, axis = axis)
+
+        position = np.linspace(0, m - 1, n)
+        index = np.minimum(position.astype(int), m - 2)
+        fraction = (position - index).astype(field.dtype).reshape((-1,) + (1,) * (field.ndim - axis - 1))
+
+        lower = field.take(index, axis = axis)
+        return lower + fraction * (field.take(index + 1, axis = axis) - lower)
+
+    def _warp_displacement(self, resolution, time, warp_freq, freq_t, warp_octaves, warp_amplitude):
+    # Fractal displacements of the grid points along the spatial axes, evaluated at resolution and upsampled.
+    # time holds the evaluated frames of the time axis (empty without one).
+        variant = 'classic' if warp_octaves == 1 else 'fractal'
+        self._set_parameters((warp_freq,) * self.n_spatial + (freq_t,) * self.time_axis, warp_octaves, 1, 0.5, 2)
+
+        n = len(self.axes)
+        axes = [np.linspace(0, 1, m, dtype = self.dtype).reshape([-1 if d == dim else 1 for d in range(n)])
+                for m, dim in zip(resolution, self.grid_dims)]
+
+        displacement = []
+        for shifts in self.warp_shifts:
+            field = self._compute((variant,), *(axis + shift for axis, shift in zip(axes, shifts)), *time)[variant]
+            for N, dim in zip(self.samples, self.grid_dims[:self.n_spatial]):
+                field = self._upsample(field, dim, N)
+            displacement.append(field * warp_amplitude)
+
+        return displacement
+
+    def _check_warp(self, variant, resolution):
+    # Assert that variant can be domain-warped with warp fields of the given resolution
+        assert variant in self.variants, f'Invalid variant: {variant}. Must be one of {self.variants}.'
+        assert self.n_seeds is None and all(P is None for P in self.periods), \
+            'Domain warping needs a single permutation and no tiling periods'
+        assert len(resolution) == self.n_spatial and all(n >= 1 for n in resolution), \
+            f'Give the warp resolution as one number of samples per spatial axis: {self.axes[:self.n_spatial]}'
+
+    def _warp(self, variant, freqs, multiscale, warp, resolution, time_index = slice(None), errors = None):
+    # Domain-warped variant over the frames time_index. multiscale is (octaves, amplitude, persistence, lacunarity,
+    # lod) and warp (warp_freq, warp_amplitude, warp_octaves). errors accumulates the warp errors.
+
+        warp_freq, warp_amplitude, warp_octaves = warp
+        freq_t = freqs[-1] if self.time_axis else None
+        time = (self.domain()[-1][..., time_index],) if self.time_axis else ()
+
+        def warped(displacement):
+            self._set_variant(variant, freqs, *multiscale)
+            spatial = self.domain()[:self.n_spatial]
+            return self._compute((variant,), *(axis + d for axis, d in zip(spatial, displacement)), *time)[variant]
+
+        displacement = self._warp_displacement(resolution, time, warp_freq, freq_t, warp_octaves, warp_amplitude)
+        result = warped(displacement)
+
+        if errors is not None:
+            full_displacement = self._warp_displacement(self.samples[:self.n_spatial], time, warp_freq, freq_t,
+                                                        warp_octaves, warp_amplitude)
+            displacement_error = np.stack(displacement) - np.stack(full_displacement)
+            error = result - warped(full_displacement)
+            errors['displacement_max'] = max(errors['displacement_max'], float(np.abs(displacement_error).max()))
+            errors['displacement_rms'] += float(np.sum(displacement_error ** 2))
+            errors['max'] = max(errors['max'], float(np.abs(error).max()))
+            errors['rms'] += float(np.sum(error ** 2))
+
+        return result
+
+    def _warp_errors(self, errors = None, size = None):
+    # Empty error accumulator of _warp, or the max and RMS errors of an accumulated one over a result of size samples
+        if errors is None:
+            return {'displacement_max': 0.0, 'displacement_rms': 0.0, 'max': 0.0, 'rms': 0.0}
+
+        return {**errors,
+                'displacement_rms': float(np.sqrt(errors['displacement_rms'] / (self.n_spatial * size))),
+                'rms': float(np.sqrt(errors['rms'] / size))}
+
+    @staticmethod
+    def _tile_length(period, step, n):
+    # Number of samples in one tiling period of an axis of n samples spaced step lattice cells apart,
+    # or None if the axis does not cover more than one whole period
+        if period is None or n < 2:
+            return None
+        m = round(period / step)
+        if m >= n or not np.isclose(m * step, period, rtol = 1e-9, atol = 0):
+            return None
+        return m
+
+    def _cache_key(self, variants, index):
+    # Cache key of the results of variants at grid index for the stored parameters
+        return (tuple(variants), self.freqs, self.octaves, self.amplitude, self.persistence, self.lacunarity,
+                self.lod, self.gradient, index)
+
+    def _window_axes(self, axes, index, steps):
+    # Axes of the window index of the grid, and per grid dimension the indices expanding them to the window.
+    # Along an axis covering several periods only samples of the first period are evaluated.
+        axes = list(axes)
+        inverse = [None] * len(axes)
+
+        for k, dim in enumerate(self.grid_dims):
+            n = axes[k].shape[dim]
+            samples = range(n)[index[dim]]
+            indices = np.arange(samples.start, samples.stop, samples.step)
+            m = self._tile_length(self.periods[k], steps[k], n)
+            if m is not None:
+                indices, inverse[dim] = np.unique(indices % m, return_inverse = True)
+            axes[k] = axes[k].take(indices, axis = dim)
+
+        return axes, inverse
+
+    def _compute_grid(self, variants, index = None):
+    # _compute over the grid or its window index. Along an axis covering several periods only the first period
+    # is evaluated, then replicated.
+        n = len(self.axes)
+        if index is None:
+            index = (slice(None),) * n
+
+        if self.cache is not None:
+            key = self._cache_key(variants, tuple((s.start, s.stop, s.step) for s in index))
+            results = self.cache.get(key)
+            if results is not None:
+                return results
+
+        # Lattice cells per sample of each axis; frames are freq_t cells apart
+        steps = tuple(freq / max(N - 1, 1) for freq, N in zip(self.freqs[:self.n_spatial], self.samples)) \
+                + self.freqs[self.n_spatial:]
+        axes, inverse = self._window_axes(self.domain(), index, steps)
+
+        # Grid dimensions of a single sample (other than the rows, e.g. one frame) are evaluated without their axis,
+        # so the innermost loops of the broadcasts stay long, and restored afterwards
+        shape = tuple(axes[self.grid_dims.index(dim)].shape[dim] for dim in range(n))
+        single = tuple(dim for dim in range(1, n) if shape[dim] == 1)
+        axes = [axis.squeeze(single) for axis in axes]
+
+        if self.threads is None:
+            results = self._compute(variants, *axes)
+        else:
+            results = self._compute_blocks(variants, *axes)
+
+        seed_shape = () if self.n_seeds is None else (self.n_seeds,)
+        results = {v: r.reshape(seed_shape + shape) for v, r in results.items()}
+
+        for dim, indices in enumerate(inverse):
+            if indices is not None:
+                results = {v: r.take(indices, axis = dim - n) for v, r in results.items()}
+
+        if self.cache is not None:
+            self.cache.put(key, results)
+
+        return results
+
+    def _check_window(self, index, names):
+    # Assert that index holds one slice per grid dimension, each selecting at least one sample
+        assert all(isinstance(s, slice) and len(range(N)[s]) > 0 for s, N in zip(index, self.grid_shape)), \
+            f'{names} must be slices selecting at least one sample'
+
+    def _octave_noise(self, points, seed_index, freqs, periods = None):
+    # Base noise of one octave at spatial frequencies freqs and, if they are computed, its derivatives along every
+    # axis in the units of the grid (per unit of the [0, 1] domain coordinates), or None
+        coords = [point * freq for point, freq in zip(points, freqs)] + points[len(freqs):]
+        result = self._noise(coords, seed_index, periods, self.gradient)
+        if not self.gradient:
+            return result, None
+
+        tmp_result, derivatives = result
+        scales = list(freqs) + [self.freqs[-1] * (self.samples[-1] - 1)] * self.time_axis
+        return tmp_result, tuple(d * scale for d, scale in zip(derivatives, scales))
+
+    def _add_derivatives(self, results, variant, derivatives, slope):
+    # Accumulate the derivatives of one octave, times the slope of the variant's octave term in the noise
+        for axis, derivative in zip(self.axes, derivatives):
+            results[f'{variant}_d{axis}'] += derivative * slope
+
+    def _ridge_term(self, abs_result, amplitude, sign = None):
+    # 1 - |n| of the ridge octave term (1 - |n|)^2 * amplitude and, given the sign of n, the slope of the term in n
+        ridge_result = 1 - abs_result
+        slope = None if sign is None else -2 * ridge_result * sign * amplitude
+        return ridge_result, slope
+
+    def _add_octave(self, results, variants, octave, tmp_result, amplitude, derivatives = None):
+    # Accumulate the base noise of one octave (and its derivatives, if given) into the multiscale results.
+    # 'classic' is the first octave.
+
+        if octave == 0 and 'classic' in variants:
+            results['classic'] = tmp_result
+            for axis, derivative in zip(self.axes, derivatives or ()):
+                results[f'classic_d{axis}'] = derivative
+
+        if 'fractal' in results:
+            results['fractal'] += tmp_result * amplitude
+            if derivatives is not None:
+                self._add_derivatives(results, 'fractal', derivatives, amplitude)
+
+        if 'turb' in results or 'ridge' in results:
+            abs_result = np.abs(tmp_result)
+            sign = None if derivatives is None else np.sign(tmp_result)
+
+        if 'turb' in results:
+            results['turb'] += abs_result * amplitude
+            if derivatives is not None:
+                self._add_derivatives(results, 'turb', derivatives, sign * amplitude)
+
+        if 'ridge' in results:
+            ridge_result, slope = self._ridge_term(abs_result, amplitude, sign)
+            if derivatives is not None:
+                self._add_derivatives(results, 'ridge', derivatives, slope)
+            ridge_result *= ridge_result
+            results['ridge'] += ridge_result * amplitude
+
+    def _accumulate(self, variants, points, shape, seed_index = slice(None)):
+    # Octave loop of _compute over points of the given broadcast shape, for the seeds selected by seed_index
+
+        if self.n_seeds is not None:
+            shape = self.seed_offset[seed_index].shape + shape
+        classic_keys = self._outputs(('classic',))
+        results = {v: np.zeros(shape, dtype = self.dtype) for v in self._outputs(variants) if v not in classic_keys}
+
+        freqs = self.freqs[:self.n_spatial]
+
+        if not results: # 'classic' alone is a single octave without accumulation
+            start = time.perf_counter()
+            tmp_result, derivatives = self._octave_noise(points, seed_index, freqs)
+            self._add_octave(results, ('classic',), 0, tmp_result, None, derivatives)
+            if self.observer is not None:
+                self.observer.on_octave(0, time.perf_counter() - start)
+            return results
+
+        maxValue = 0
+        amplitude = self.amplitude
+        scale = 1 # Frequency of the octave relative to the initial one
+
+        for octave, weight in enumerate(self.octave_weights):
+
+            start = time.perf_counter()
+
+            if weight > 0: # Octaves skipped by the level-of-detail mode are not evaluated
+                tmp_result, derivatives = self._octave_noise(points, seed_index, freqs, self._octave_periods(scale))
+
+                self._add_octave(results, variants, octave, tmp_result, amplitude * weight, derivatives)
+
+            amplitude *= self.persistence
+            freqs = [freq * self.lacunarity for freq in freqs]
+            scale *= self.lacunarity
+
+            maxValue += amplitude * weight # May not be necessary for ridge
+
+            if self.observer is not None and weight > 0:
+                self.observer.on_octave(octave, time.perf_counter() - start)
+
+        for v in results:
+            if v not in classic_keys:
+                results[v] /= maxValue
+
+        return results
+
+    def _sample(self, points, variant, freqs, octaves, initial_amplitude, persistence, lacunarity, chunk_size):
+    # Noise at arbitrary points, an (M, n_axes) array in the units of the grid methods, processed in chunks of
+    # chunk_size to keep peak memory flat. Returns an (M,) array, or (n_seeds, M) for several seeds.
+
+        points = np.asarray(points)
+        n = len(self.axes)
+        assert points.ndim == 2 and points.shape[1] == n, f'Points must have shape (M, {n})'
+
+        self._set_variant(variant, freqs, octaves, initial_amplitude, persistence, lacunarity)
+
+        seed_shape = () if self.n_seeds is None else (self.n_seeds,)
+        result = np.empty(seed_shape + (points.shape[0],), dtype = self.dtype)
+
+        for start in range(0, points.shape[0], chunk_size):
+
+            chunk = points[start:start + chunk_size].astype(self.dtype)
+
+            result[..., start:start + chunk_size] = self._compute((variant,), *chunk.T)[variant]
+
+        return result
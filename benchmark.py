@@ -0,0 +1,430 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Perlin_2D import Perlin2D
+from Perlin_3D import Perlin3D
+from Perlin_4D import Perlin4D
+
+# %% Reference implementations
+
+class BranchingPerlin3D(Perlin3D):
+# Perlin3D with the original np.where gradient selection
+
+    def grad(self, hash, x, y, z):
+       h = hash & 15
+
+       u = np.where(h < 8, x, y)
+       v = np.where(h < 4, y, np.where((h == 12) | (h == 14), x, z))
+
+       u = np.where(h & 1 == 0, u, -u)
+       v = np.where(h & 2 == 0, v, -v)
+
+       return u + v
+
+class BranchingPerlin4D(Perlin4D):
+# Perlin4D with the original np.where gradient selection
+
+    def grad(self, hash, x, y, z, w):
+       h = hash & 31
+       u = np.where(h >> 3 == 1, y, np.where(h >> 3 == 2, w, np.where(h >> 3 == 3, z, x)))
+       v = np.where(h >> 3 == 1, z, np.where(h >> 3 == 2, x, np.where(h >> 3 == 3, w, y)))
+       c = np.where(h >> 3 == 1, w, np.where(h >> 3 == 2, y, np.where(h >> 3 == 3, x, z)))
+
+       u_term = np.where(h & 4 == 0, u, -u)
+       v_term = np.where(h & 2 == 0, v, -v)
+       c_term = np.where(h & 1 == 0, c, -c)
+
+       return u_term + v_term + c_term
+
+# %% Measurement helpers
+
+def measure(func, *args, repeats = 3):
+# Best wall time (s) and peak traced NumPy allocation (bytes) of func(*args)
+
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    return result, min(times), peak
+
+def random_points(n_dims, n_points, scale = 16, seed = 0):
+    rng = np.random.default_rng(seed)
+    return [rng.random(n_points) * scale for _ in range(n_dims)]
+
+# %% Benchmarks
+
+def bench_gradient(n_points = 1_000_000):
+# Compare gen_Perlin with the lookup-table gradient against the branching gradient
+
+    print(f'****** gen_Perlin gradient kernel ({n_points} points) ******')
+
+    cases = [('3D', BranchingPerlin3D(2, 2, 2), Perlin3D(2, 2, 2), 3),
+             ('4D', BranchingPerlin4D(2, 2, 2, 2), Perlin4D(2, 2, 2, 2), 4)]
+
+    for name, reference, table, n_dims in cases:
+        points = random_points(n_dims, n_points)
+
+        ref_result, ref_time, ref_peak = measure(reference.gen_Perlin, *points)
+        new_result, new_time, new_peak = measure(table.gen_Perlin, *points)
+
+        assert np.array_equal(ref_result, new_result), 'Lookup-table gradient differs from reference'
+
+        print(f'{name} branching: {ref_time*1e3:8.1f} ms, peak {ref_peak/2**20:7.1f} MiB')
+        print(f'{name} table:     {new_time*1e3:8.1f} ms, peak {new_peak/2**20:7.1f} MiB '
+              f'({ref_time/new_time:.2f}x faster)')
+
+
+def bench_dtype(Nx = 512, Ny = 512, N_frames = 20, Nv = 48, N_volumes = 4):
+# Compare float64 and float32 generation of the fractal variants
+
+    print('****** float64 vs float32 fractal_Perlin ******')
+
+    cases = [('3D', lambda dtype: Perlin3D(Nx, Ny, N_frames, dtype = dtype).fractal_Perlin, (5, 5, 0.1)),
+             ('4D', lambda dtype: Perlin4D(Nv, Nv, Nv, N_volumes, dtype = dtype).fractal_Perlin, (5, 5, 5, 0.1))]
+
+    for name, make, args in cases:
+        ref_result, ref_time, ref_peak = measure(make(np.float64), *args, repeats = 1)
+        new_result, new_time, new_peak = measure(make(np.float32), *args, repeats = 1)
+
+        print(f'{name} float64: {ref_time*1e3:8.1f} ms, peak {ref_peak/2**20:7.1f} MiB')
+        print(f'{name} float32: {new_time*1e3:8.1f} ms, peak {new_peak/2**20:7.1f} MiB '
+              f'({ref_time/new_time:.2f}x faster, max deviation {np.abs(ref_result - new_result).max():.1e})')
+
+
+def bench_backend(Nx = 256, Ny = 256, N_frames = 16, Nv = 48, N_volumes = 4):
+# Compare the perlin and simplex backends at equal resolution
+
+    print('****** perlin vs simplex backend ******')
+
+    cases = [('3D', lambda backend: Perlin3D(Nx, Ny, N_frames, backend = backend), (5, 5, 0.1)),
+             ('4D', lambda backend: Perlin4D(Nv, Nv, Nv, N_volumes, backend = backend), (5, 5, 5, 0.1))]
+
+    for name, make, args in cases:
+        for method in ('classic_Perlin', 'fractal_Perlin'):
+            _, ref_time, ref_peak = measure(getattr(make('perlin'), method), *args, repeats = 1)
+            _, new_time, new_peak = measure(getattr(make('simplex'), method), *args, repeats = 1)
+
+            print(f'{name} {method:<15} perlin:  {ref_time*1e3:8.1f} ms, peak {ref_peak/2**20:7.1f} MiB')
+            print(f'{name} {method:<15} simplex: {new_time*1e3:8.1f} ms, peak {new_peak/2**20:7.1f} MiB '
+                  f'({ref_time/new_time:.2f}x speed-up)')
+
+
+def bench_threads(Nx = 512, Ny = 512, N_frames = 16):
+# Single-pass against blocked, threaded Perlin3D grid evaluation
+
+    print(f'****** Perlin3D threads, fractal {Nx}x{Ny}x{N_frames} ({multiprocessing.cpu_count()} CPUs) ******')
+
+    ref_result = None
+    for threads in (None,) + tuple(sorted({1, 2, multiprocessing.cpu_count()})):
+        result, seconds, peak = measure(Perlin3D(Nx, Ny, N_frames, threads = threads).fractal_Perlin, 5, 5, 0.1, repeats = 1)
+
+        if ref_result is None:
+            ref_result, ref_time = result, seconds
+        assert np.array_equal(ref_result, result), 'Threaded result differs from single pass'
+
+        print(f'threads = {str(threads):<4} {seconds*1e3:8.1f} ms, peak {peak/2**20:7.1f} MiB ({ref_time/seconds:.2f}x speed-up)')
+
+
+def bench_warp(Nx = 512, Ny = 512, N_frames = 4, warp_octaves = 4):
+# Reduced-resolution warp fields against the full-resolution warp: time and error of the warped result
+
+    print(f'****** Perlin3D domain warp, fractal {Nx}x{Ny}x{N_frames}, {warp_octaves} warp octaves ******')
+
+    perlin = Perlin3D(Nx, Ny, N_frames)
+    args = ('fractal', 8, 8, 1)
+    kwargs = {'warp_freq': 2, 'warp_amplitude': 0.1, 'warp_octaves': warp_octaves}
+
+    _, ref_time, _ = measure(lambda: perlin.warp_Perlin(*args, **kwargs), repeats = 1)
+    print(f'full resolution   {ref_time*1e3:8.1f} ms')
+
+    for n in (Nx // 4, Nx // 8, Nx // 16, Nx // 32):
+        resolution = (n, n * Ny // Nx)
+        _, seconds, _ = measure(lambda: perlin.warp_Perlin(*args, **kwargs, warp_resolution = resolution), repeats = 1)
+        perlin.warp_Perlin(*args, **kwargs, warp_resolution = resolution, report_error = True)
+        error = perlin.warp_error
+
+        print(f'warp {resolution[0]:>4} x {resolution[1]:<4} {seconds*1e3:8.1f} ms ({ref_time/seconds:.2f}x speed-up), '
+              f'displacement error max {error["displacement_max"]:.1e}, result error max {error["max"]:.1e} '
+              f'rms {error["rms"]:.1e}')
+
+
+def bench_static(Nx = 1024, Ny = 1024, octaves = 6):
+# Static images: Perlin2D against a single-frame Perlin3D, the only option before Perlin2D
+
+    print(f'****** Static {Nx}x{Ny} image: Perlin2D vs Perlin3D(Nx, Ny, 1) ******')
+
+    cases = [('classic_Perlin', (16, 16), {}), ('fractal_Perlin', (8, 8), {'octaves': octaves})]
+
+    for method, freqs, kwargs in cases:
+        func_3D = getattr(Perlin3D(Nx, Ny, 1), method)
+        func_2D = getattr(Perlin2D(Nx, Ny), method)
+        _, ref_time, ref_peak = measure(lambda: func_3D(*freqs, 0.1, **kwargs))
+        _, new_time, new_peak = measure(lambda: func_2D(*freqs, **kwargs))
+
+        print(f'{method:<15} Perlin3D: {ref_time*1e3:8.1f} ms, peak {ref_peak/2**20:7.1f} MiB')
+        print(f'{method:<15} Perlin2D: {new_time*1e3:8.1f} ms, peak {new_peak/2**20:7.1f} MiB '
+              f'({ref_time/new_time:.2f}x faster)')
+
+
+def finite_differences(perlin, method, args, h = 1e-6):
+# Forward differences of a *_Perlin method in grid units: one evaluation plus one per axis with that axis shifted
+    base = getattr(perlin, method)(*args)
+
+    derivatives = []
+    for k, axis in enumerate(perlin.grid_axes):
+        perlin.grid_axes[k] = axis + h
+        derivatives.append((getattr(perlin, method)(*args) - base) / h)
+        perlin.grid_axes[k] = axis
+
+    return base, tuple(derivatives)
+
+
+def bench_derivatives(Nx = 256, Ny = 256, N_frames = 8, Nv = 64, N_volumes = 2):
+# Analytic derivatives (return_gradient) against forward finite differences: time, peak memory and deviation
+
+    print('****** return_gradient vs finite differences ******')
+
+    cases = [('3D', Perlin3D(Nx, Ny, N_frames), (5, 5, 0.1)),
+             ('4D', Perlin4D(Nv, Nv, Nv, N_volumes), (5, 5, 5, 0.1))]
+
+    for name, perlin, args in cases:
+        for method in ('classic_Perlin', 'fractal_Perlin'):
+            ref_result, ref_time, ref_peak = measure(finite_differences, perlin, method, args, repeats = 1)
+            new_result, new_time, new_peak = measure(lambda: getattr(perlin, method)(*args, return_gradient = True),
+                                                     repeats = 1)
+            deviation = max(np.abs(a - b).max() for a, b in zip(ref_result[1], new_result[1]))
+
+            print(f'{name} {method:<15} finite differences: {ref_time*1e3:8.1f} ms, peak {ref_peak/2**20:7.1f} MiB')
+            print(f'{name} {method:<15} return_gradient:    {new_time*1e3:8.1f} ms, peak {new_peak/2**20:7.1f} MiB '
+                  f'({ref_time/new_time:.2f}x faster, max deviation {deviation:.1e})')
+
+
+def bench_stepper(Nx = 512, Ny = 512, n_frames = 120, octaves = 4):
+# Per-frame latency of the real-time stepper against lazily generated frames. The stepper's maximum is a frame
+# entering a new time lattice cell (every 1 / freq_t frames of the grid).
+
+    print(f'****** Per-frame latency, fractal {Nx}x{Ny}, {octaves} octaves ******')
+
+    perlin = Perlin3D(Nx, Ny, n_frames)
+    frames = perlin.iter_frames('fractal', 5, 5, 0.1, octaves = octaves)
+    stepper = perlin.stepper('fractal', 5, 5, 0.1, octaves = octaves)
+    dt = 1 / (n_frames - 1)
+
+    for name, step in (('iter_frames', lambda: next(frames)), ('stepper', lambda: stepper.next_frame(dt))):
+        latency = []
+        for _ in range(n_frames - 1):
+            start = time.perf_counter()
+            step()
+            latency.append(time.perf_counter() - start)
+
+        latency = np.array(latency) * 1e3
+        print(f'{name:<12} median {np.median(latency):7.2f} ms, mean {latency.mean():7.2f} ms, '
+              f'max {latency.max():7.2f} ms ({1e3 / latency.mean():6.1f} fps)')
+
+
+# %% Regression suite
+
+# Sweeps over gen_Perlin point counts, grid sizes (including frame counts) and octave counts
+SWEEPS = {
+    'quick': {'points': [2**16],
+              'grids_2D': [(256, 256)],
+              'grids_3D': [(64, 64, 8), (128, 128, 16)],
+              'grids_4D': [(16, 16, 16, 4)],
+              'octaves': [1, 4]},
+    'full': {'points': [2**16, 2**20],
+             'grids_2D': [(512, 512), (2048, 2048)],
+             'grids_3D': [(128, 128, 16), (256, 256, 16), (256, 256, 64), (512, 512, 32)],
+             'grids_4D': [(32, 32, 32, 4), (32, 32, 32, 16), (64, 64, 64, 8)],
+             'octaves': [1, 4, 8]},
+}
+
+MULTISCALE = ('fractal_Perlin', 'turb_Perlin', 'ridge_Perlin')
+
+def suite_cases(sweep):
+# Benchmark cases of a sweep as JSON-serialisable dicts
+
+    cases = []
+
+    for n_points in sweep['points']:
+        for dims in (2, 3, 4):
+            cases.append({'dims': dims, 'method': 'gen_Perlin', 'shape': [n_points], 'octaves': None})
+
+    for dims, grids in ((2, sweep['grids_2D']), (3, sweep['grids_3D']), (4, sweep['grids_4D'])):
+        for grid in grids:
+            cases.append({'dims': dims, 'method': 'classic_Perlin', 'shape': list(grid), 'octaves': None})
+            for method in MULTISCALE:
+                for octaves in sweep['octaves']:
+                    cases.append({'dims': dims, 'method': method, 'shape': list(grid), 'octaves': octaves})
+
+    return cases
+
+def peak_rss():
+# Peak resident set size of this process in bytes (None where unavailable)
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def run_case(case, repeats = 1):
+# Time one case. Run in a fresh process so peak_rss_bytes belongs to this case only
+
+    baseline_rss = peak_rss()
+
+    if case['method'] == 'gen_Perlin':
+        perlin = {2: Perlin2D(2, 2), 3: Perlin3D(2, 2, 2), 4: Perlin4D(2, 2, 2, 2)}[case['dims']]
+        func = perlin.gen_Perlin
+        args = random_points(case['dims'], case['shape'][0])
+        kwargs = {}
+    else:
+        Nx, Ny = case['shape'][:2]
+        if case['dims'] == 2:
+            perlin = Perlin2D(Nx, Ny)
+            args = (5, 5)
+        elif case['dims'] == 3:
+            perlin = Perlin3D(Nx, Ny, case['shape'][2])
+            args = (5, 5, 0.1)
+        else:
+            perlin = Perlin4D(Nx, Ny, *case['shape'][2:])
+            args = (5, 5, 5, 0.1)
+        func = getattr(perlin, case['method'])
+        kwargs = {} if case['octaves'] is None else {'octaves': case['octaves']}
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    samples = int(np.prod(case['shape']))
+
+    return {**case,
+            'samples': samples,
+            'time_s': min(times),
+            'samples_per_s': samples / min(times),
+            'baseline_rss_bytes': baseline_rss,
+            'peak_rss_bytes': peak_rss()}
+
+def run_suite(sweep = 'quick', repeats = 1, json_path = None):
+# Run every case of a sweep, print a table and optionally save the results as JSON
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    print(f'****** Benchmark suite ({sweep}) ******')
+    print(f'{"dims":>4} {"method":<15} {"shape":<20} {"octaves":>7} {"time (s)":>9} {"samples/s":>11} {"peak RSS (MiB)":>15}')
+
+    for case in suite_cases(SWEEPS[sweep]):
+        with ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+            result = executor.submit(run_case, case, repeats).result()
+        results.append(result)
+
+        rss = '-' if result['peak_rss_bytes'] is None else f'{result["peak_rss_bytes"]/2**20:.1f}'
+        print(f'{result["dims"]:>4} {result["method"]:<15} {str(tuple(result["shape"])):<20} {str(result["octaves"] or "-"):>7} '
+              f'{result["time_s"]:>9.3f} {result["samples_per_s"]:>11.3e} {rss:>15}')
+
+    report = {'metadata': {'sweep': sweep,
+                           'repeats': repeats,
+                           'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                           'python': platform.python_version(),
+                           'numpy': np.__version__,
+                           'platform': platform.platform(),
+                           'cpu_count': multiprocessing.cpu_count()},
+              'results': results}
+
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent = 2)
+        print(f'Saved as: {json_path}')
+
+    return report
+
+def case_key(result):
+    return (result['dims'], result['method'], tuple(result['shape']), result['octaves'])
+
+def compare(old_path, new_path, tolerance = 0.1):
+# Compare two suite JSON files and flag cases that became slower by more than tolerance (fractional)
+
+    with open(old_path) as f:
+        old = {case_key(r): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {case_key(r): r for r in json.load(f)['results']}
+
+    common = sorted(old.keys() & new.keys(), key = str)
+    regressions = 0
+    print(f'****** {new_path} vs {old_path} ******')
+
+    for key in common:
+        ratio = new[key]['time_s'] / old[key]['time_s']
+        flag = 'REGRESSION' if ratio > 1 + tolerance else ''
+        regressions += bool(flag)
+        print(f'{key[0]}D {key[1]:<15} {str(key[2]):<20} {str(key[3] or "-"):>3} {ratio:6.2f}x time {flag}')
+
+    print(f'{regressions} regression(s) in {len(common)} common cases')
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Perlin noise benchmarks')
+    subparsers = parser.add_subparsers(dest = 'command')
+
+    suite_parser = subparsers.add_parser('suite', help = 'timing and memory sweep (default)')
+    suite_parser.add_argument('--sweep', choices = SWEEPS, default = 'quick')
+    suite_parser.add_argument('--repeats', type = int, default = 1)
+    suite_parser.add_argument('--json', dest = 'json_path', default = None, help = 'save results to this JSON file')
+
+    subparsers.add_parser('gradient', help = 'lookup-table vs branching gradient kernel')
+    subparsers.add_parser('derivatives', help = 'return_gradient vs finite differences')
+    subparsers.add_parser('dtype', help = 'float64 vs float32')
+    subparsers.add_parser('stepper', help = 'per-frame latency of Perlin3D.stepper')
+    subparsers.add_parser('backend', help = 'perlin vs simplex backend')
+    subparsers.add_parser('threads', help = 'single-pass vs threaded Perlin3D grids')
+    subparsers.add_parser('warp', help = 'reduced-resolution vs full-resolution domain warp')
+    subparsers.add_parser('static', help = 'Perlin2D vs single-frame Perlin3D images')
+
+    compare_parser = subparsers.add_parser('compare', help = 'compare two suite JSON files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--tolerance', type = float, default = 0.1)
+
+    args = parser.parse_args()
+
+    if args.command == 'gradient':
+        bench_gradient()
+    elif args.command == 'derivatives':
+        bench_derivatives()
+    elif args.command == 'dtype':
+        bench_dtype()
+    elif args.command == 'stepper':
+        bench_stepper()
+    elif args.command == 'backend':
+        bench_backend()
+    elif args.command == 'threads':
+        bench_threads()
+    elif args.command == 'warp':
+        bench_warp()
+    elif args.command == 'static':
+        bench_static()
+    elif args.command == 'compare':
+        sys.exit(1 if compare(args.old, args.new, args.tolerance) else 0)
+    elif args.command == 'suite':
+        run_suite(args.sweep, args.repeats, args.json_path)
+    else:
+        run_suite()
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+# Bounded least-recently-used cache of noise results (dicts of arrays keyed by variant), used by Perlin3D and
+# Perlin4D when they are created with cache_bytes. Entries are copied in and out, so callers may modify the
+# arrays they get. The least recently used entries are evicted once the stored arrays exceed max_bytes.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def get(self, key):
+    # Copy of the results stored under key, or None
+        results = self.entries.get(key)
+
+        if results is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return {v: result.copy() for v, result in results.items()}
+
+    def put(self, key, results):
+    # Store a copy of results under key. Results larger than the whole cache are not stored.
+        nbytes = sum(result.nbytes for result in results.values())
+        if nbytes > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.nbytes -= sum(result.nbytes for result in self.entries.pop(key).values())
+
+        self.entries[key] = {v: result.copy() for v, result in results.items()}
+        self.nbytes += nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last = False)
+            self.nbytes -= sum(result.nbytes for result in evicted.values())
+            self.evictions += 1
+
+    def stats(self):
+    # Hit, miss and eviction counts and the current size
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes}
@@ -1,6 +1,7 @@
 import matplotlib.pyplot as plt
 from Perlin_4D import Perlin4D
 from utils import normalise, save_gif
+from instrumentation import ProgressBar
 # %% Setup basic parameters
 
 Nx = 64 
@@ -15,7 +16,7 @@ freq_t = 0.1
 
 # %% Generate noise fields
 
-Perl = Perlin4D(Nx, Ny, Nz, N_frames)
+Perl = Perlin4D(Nx, Ny, Nz, N_frames, observer = ProgressBar())
 
 classic_Perlin = Perl.classic_Perlin(freq_x, freq_y, freq_z, freq_t)
 fractal_Perlin = Perl.fractal_Perlin(freq_x, freq_y, freq_z, freq_t)
@@ -0,0 +1,138 @@
+import time
+import numpy as np
+
+class Observer:
+# Instrumentation hooks called by Perlin3D and Perlin4D when set as their observer. Override the methods of interest.
+# All timings are wall-clock seconds.
+
+    def on_stage(self, stage, seconds, nbytes):
+    # A stage of gen_Perlin finished: 'lattice', 'hashing', 'gradient' or 'interpolation'.
+    # nbytes is the size of the arrays the stage produced.
+        pass
+
+    def on_octave(self, octave, seconds):
+    # One octave (one gen_Perlin evaluation plus accumulation) finished
+        pass
+
+    def on_slice(self, index, total, seconds):
+    # A Perlin4D time slice or a block of Perlin3D.iter_frames finished
+        pass
+
+
+class Observers(Observer):
+# Forward every event to several observers
+
+    def __init__(self, *observers):
+        self.observers = observers
+
+    def on_stage(self, stage, seconds, nbytes):
+        for observer in self.observers:
+            observer.on_stage(stage, seconds, nbytes)
+
+    def on_octave(self, octave, seconds):
+        for observer in self.observers:
+            observer.on_octave(octave, seconds)
+
+    def on_slice(self, index, total, seconds):
+        for observer in self.observers:
+            observer.on_slice(index, total, seconds)
+
+
+class Profiler(Observer):
+# Aggregate count, total, min and max time (and bytes for stages) per stage, per octave and over all slices
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+
+    def _add(self, key, seconds, nbytes = 0):
+        stats = self.stats.setdefault(key, {'count': 0, 'total_s': 0.0, 'min_s': float('inf'), 'max_s': 0.0, 'bytes': 0})
+        stats['count'] += 1
+        stats['total_s'] += seconds
+        stats['min_s'] = min(stats['min_s'], seconds)
+        stats['max_s'] = max(stats['max_s'], seconds)
+        stats['bytes'] += nbytes
+
+    def on_stage(self, stage, seconds, nbytes):
+        self._add(f'stage:{stage}', seconds, nbytes)
+
+    def on_octave(self, octave, seconds):
+        self._add(f'octave:{octave}', seconds)
+
+    def on_slice(self, index, total, seconds):
+        self._add('slice', seconds)
+
+    def summary(self):
+    # Aggregated statistics keyed by 'stage:<name>', 'octave:<n>' and 'slice'
+        return {key: dict(stats, mean_s = stats['total_s'] / stats['count']) for key, stats in self.stats.items()}
+
+    def report(self):
+        print('****** Profile ******')
+        print(f'{"event":<22} {"count":>7} {"total (s)":>10} {"mean (ms)":>10} {"max (ms)":>10} {"MiB":>10}')
+        for key, stats in sorted(self.summary().items()):
+            print(f'{key:<22} {stats["count"]:>7} {stats["total_s"]:>10.3f} {stats["mean_s"]*1e3:>10.2f} '
+                  f'{stats["max_s"]*1e3:>10.2f} {stats["bytes"]/2**20:>10.1f}')
+
+
+class ProgressBar(Observer):
+# tqdm progress bar over slices. tqdm is only imported once the first slice finishes.
+
+    def __init__(self, **tqdm_kwargs):
+        self.tqdm_kwargs = tqdm_kwargs
+        self.bar = None
+
+    def on_slice(self, index, total, seconds):
+        if self.bar is None:
+            from tqdm import tqdm
+            self.bar = tqdm(total = total, **self.tqdm_kwargs)
+
+        self.bar.update(1)
+
+        if self.bar.n >= total:
+            self.close()
+
+    def close(self):
+        if self.bar is not None:
+            self.bar.close()
+            self.bar = None
+
+
+class StageClock:
+# Times consecutive stages of one gen_Perlin call and reports them to an observer
+
+    def __init__(self, observer):
+        self.observer = observer
+        self.start = time.perf_counter()
+        self.nested = {}
+
+    def timed(self, stage, func):
+    # Wrap func so that its run time and output size are attributed to stage
+        totals = self.nested.setdefault(stage, [0.0, 0])
+
+        def wrapper(*args):
+            start = time.perf_counter()
+            result = func(*args)
+            totals[0] += time.perf_counter() - start
+            totals[1] += result.nbytes
+            return result
+
+        return wrapper
+
+    def lap(self, stage, *arrays):
+    # End stage, which produced arrays. Time spent in timed() calls of other stages is reported separately.
+        now = time.perf_counter()
+        seconds = now - self.start
+        nbytes = sum(np.asarray(a).nbytes for a in arrays)
+        self.start = now
+
+        for other, (other_seconds, other_bytes) in self.nested.items():
+            if other == stage:
+                nbytes += other_bytes
+            else:
+                seconds -= other_seconds
+                self.observer.on_stage(other, other_seconds, other_bytes)
+
+        self.nested = {}
+        self.observer.on_stage(stage, seconds, nbytes)
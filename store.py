@@ -0,0 +1,124 @@
+import json
+import os
+import numpy as np
+
+INDEX_NAME = 'index.json'
+FORMAT_VERSION = 1
+
+
+def chunk_grid(shape, chunks):
+# Chunk positions (one index per axis) and the slices of the volume they cover, in C order
+    counts = [-(-n // c) for n, c in zip(shape, chunks)]
+    for position in np.ndindex(*counts):
+        yield position, tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(position, chunks, shape))
+
+def chunk_file(path, position, compressed):
+# File of the chunk at position in the store at path
+    name = 'c.' + '.'.join(str(i) for i in position)
+    return os.path.join(path, name + ('.npz' if compressed else '.npy'))
+
+def save_chunk(path, position, chunk, compressed = False):
+# Write one chunk: a raw .npy file (memory-mappable on read) or a compressed .npz file
+    if compressed:
+        np.savez_compressed(chunk_file(path, position, True), chunk = chunk)
+    else:
+        np.save(chunk_file(path, position, False), chunk)
+
+def write_index(path, shape, dtype, chunks, compressed = False, axes = None, attrs = None):
+# Write the JSON index describing the store at path. It is written after the chunks, so a store without an
+# index is an incomplete one.
+    index = {'format': FORMAT_VERSION,
+             'shape': [int(n) for n in shape],
+             'dtype': np.dtype(dtype).str,
+             'chunks': [int(c) for c in chunks],
+             'compressed': bool(compressed),
+             'axes': axes,
+             'attrs': attrs or {}}
+
+    with open(os.path.join(path, INDEX_NAME), 'w') as fp:
+        json.dump(index, fp, indent = 1)
+
+
+class ChunkedVolume:
+# Lazy read-only array over a chunked store: a directory of .npy (or compressed .npz) chunks and an index.json
+# written by Perlin4D.save_chunked (see write_index). Indexing with integers, slices (any step) and Ellipsis
+# loads only the chunks the selection touches; raw .npy chunks are memory-mapped, so only the selected part of
+# each chunk is read. np.asarray(volume) loads everything.
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_NAME)) as fp:
+            index = json.load(fp)
+
+        assert index['format'] == FORMAT_VERSION, f'Unsupported store format: {index["format"]}'
+        self.shape = tuple(index['shape'])
+        self.dtype = np.dtype(index['dtype'])
+        self.chunks = tuple(index['chunks'])
+        self.compressed = index['compressed']
+        self.axes = index['axes']
+        self.attrs = index['attrs']
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'ChunkedVolume({self.path!r}, shape={self.shape}, dtype={self.dtype}, chunks={self.chunks})'
+
+    def _load_chunk(self, position):
+        if self.compressed:
+            with np.load(chunk_file(self.path, position, True)) as data:
+                return data['chunk']
+        return np.load(chunk_file(self.path, position, False), mmap_mode = 'r')
+
+    def _selection(self, key):
+    # Selected indices along every axis, and which axes were indexed by an integer (and are dropped)
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+        assert len(key) == self.ndim, f'Too many indices for a volume of {self.ndim} dimensions'
+
+        selection = []
+        dropped = []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                samples = range(n)[k]
+                selection.append(np.arange(samples.start, samples.stop, samples.step))
+            else:
+                assert isinstance(k, (int, np.integer)), 'Only integers, slices and Ellipsis are supported'
+                assert -n <= k < n, f'Index {k} is out of bounds for axis {axis} with size {n}'
+                selection.append(np.array([k % n]))
+                dropped.append(axis)
+
+        return selection, tuple(dropped)
+
+    def __getitem__(self, key):
+        selection, dropped = self._selection(key)
+        result = np.empty(tuple(len(s) for s in selection), dtype = self.dtype)
+
+        if result.size:
+            # Output positions and within-chunk indices of every touched chunk, per axis
+            touched = []
+            for s, c in zip(selection, self.chunks):
+                chunk_ids = s // c
+                touched.append([(i, np.flatnonzero(chunk_ids == i), s[chunk_ids == i] - i * c) for i in np.unique(chunk_ids)])
+
+            for parts in np.ndindex(*(len(t) for t in touched)):
+                position, out_index, chunk_index = zip(*(t[j] for t, j in zip(touched, parts)))
+                result[np.ix_(*out_index)] = self._load_chunk(position)[np.ix_(*chunk_index)]
+
+        return result.squeeze(axis = dropped) if dropped else result
+
+    def __array__(self, dtype = None, copy = None):
+        result = self[...]
+        return result if dtype is None else result.astype(dtype)
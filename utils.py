@@ -1,43 +1,132 @@
 import numpy as np
-from PIL import Image
-import matplotlib.pyplot as plt
+from collections import deque
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from PIL import Image, GifImagePlugin
 
 def normalise(input_array):
     return (input_array - input_array.min()) / (input_array.max() - input_array.min())
-    
-def save_gif(scalar, save_name =  None, colormap = 'magma', c_range = 'global', c_min = None, c_max = None):
-    
+
+@lru_cache(maxsize = None)
+def _named_colormap_lut(colormap, lut_size):
+# matplotlib is only needed (and imported) here, once per colormap
+    import matplotlib
+
+    cmap = matplotlib.colormaps[colormap]
+    if lut_size is not None:
+        cmap = cmap.resampled(lut_size)
+
+    return (cmap(np.arange(cmap.N))[:, :3] * 255).astype('uint8')
+
+def colormap_lut(colormap, lut_size = None):
+# uint8 RGB lookup table of shape (N, 3). colormap is a matplotlib colormap name (N is its native size, usually 256,
+# or lut_size, e.g. 4096) or an (N, 3) / (N, 4) array of colours, either uint8 or floats in [0, 1].
+    if isinstance(colormap, str):
+        return _named_colormap_lut(colormap, lut_size)
+
+    colors = np.asarray(colormap)[:, :3]
+    if colors.dtype == np.uint8:
+        return colors
+    return (colors * 255).astype('uint8')
+
+def colorize(S_norm, lut):
+# Map normalised values in [0, 1] (any shape, e.g. a batch of frames) to uint8 RGB with a single gather.
+# Values are binned like matplotlib colormaps, so the result matches (cmap(S_norm)[..., :3] * 255).astype('uint8').
+# Non-finite values take the first colour.
+    N = lut.shape[0]
+    index = np.clip(np.nan_to_num(S_norm * N, nan = 0), 0, N - 1).astype(np.intp)
+    return lut[index]
+
+def iter_frames(scalar):
+# Frames of a (Ny, Nx, T) array along its last axis, or the frames of any other iterable
+    if isinstance(scalar, np.ndarray):
+        return (scalar[:, :, i] for i in range(scalar.shape[2]))
+    return iter(scalar)
+
+def frame_limits(scalar, step = 1):
+# Global colour limits from a frame-by-frame pre-pass over every step-th frame, so memory stays bounded
+    S_min = np.inf
+    S_max = -np.inf
+
+    for i, frame in enumerate(iter_frames(scalar)):
+        if i % step == 0:
+            S_min = min(S_min, frame.min())
+            S_max = max(S_max, frame.max())
+
+    return S_min, S_max
+
+def _encode_frame(S_tmp, S_min, S_max, lut, duration, first):
+# Colour one frame and encode it as GIF data. The first frame also carries the file header and global palette,
+# later frames get a local palette.
+
+    if S_min is None: # Colour limits of each individual frame
+        S_min = S_tmp.min()
+        S_max = S_tmp.max()
+
+    if S_max == S_min: # Constant field
+        S_norm = np.zeros_like(S_tmp)
+    else:
+        S_norm = (S_tmp - S_min) / (S_max - S_min)
+    colored_field_rgb = colorize(S_norm, lut)
+    tmp_image = Image.fromarray(colored_field_rgb).convert('P', palette = Image.ADAPTIVE)
+
+    data = []
+    if first:
+        header, _ = GifImagePlugin.getheader(tmp_image, info = {'loop': 0, 'duration': duration})
+        data += header
+    data += GifImagePlugin.getdata(tmp_image, duration = duration, include_color_table = not first)
+
+    return b''.join(data)
+
+def save_gif(scalar, save_name =  None, colormap = 'magma', c_range = 'global', c_min = None, c_max = None,
+             duration = 20, buffer_size = 4, workers = 1, lut_size = None, limit_step = 1):
+# Stream frames into a looping GIF. scalar is a (Ny, Nx, T) array (including np.memmap), any iterable of (Ny, Nx)
+# frames such as Perlin3D.iter_frames(...), or a callable returning such an iterable. Frames are coloured and
+# encoded on `workers` threads while at most `buffer_size` frames are in flight, so memory is bounded by a
+# handful of frames. 'global' colour limits use c_min and c_max if given, otherwise a frame-by-frame pre-pass
+# (a one-shot iterator cannot be pre-passed: give the limits or a callable). The pre-pass of a callable generates
+# every frame twice; limit_step takes the limits from every limit_step-th frame only. Frames are coloured through a
+# uint8 lookup table (see colormap_lut), so matplotlib is only needed to build it from a colormap name.
+
     assert save_name is not None, 'Give a filename.'
     assert c_range in {'global','local','custom'}, f'Invalid input: {c_range}. Must be one either \'global\',\'local\',\'custom\'.'
+    assert buffer_size >= 1 and workers >= 1 and limit_step >= 1, 'buffer_size, workers and limit_step must be at least 1'
 
-    if c_min is None and c_max is None:
-        S_min = scalar.min()
-        S_max = scalar.max()
-    if c_range == 'global': # Min and max of full array
-        S_min = scalar.min()
-        S_max = scalar.max()
-    elif c_range == 'custom': # Custom colour limits
+    if c_range == 'custom' or (c_range == 'global' and c_min is not None and c_max is not None): # Supplied colour limits
         assert c_min is not None and c_max is not None, 'Colour limits must be defined'
         S_min = c_min
         S_max = c_max
-    
+    elif c_range == 'global': # Min and max of all frames
+        assert isinstance(scalar, np.ndarray) or callable(scalar), \
+            'Global colour limits of a frame iterator need c_min and c_max, or a callable returning the iterator'
+        S_min, S_max = frame_limits(scalar() if callable(scalar) else scalar, limit_step)
+    else:
+        S_min = S_max = None
+
     print('Saving animation result...')
-    T = scalar.shape[2]
-    color_vals = plt.get_cmap(colormap)
+    lut = colormap_lut(colormap, lut_size)
 
-    frames = []
-    for i in range(T):
-        S_tmp = scalar[:, :, i]  
-        
-        if c_range == 'local': # Colour limits of each individual frame
-            S_min = S_tmp.min()
-            S_max = S_tmp.max()
+    frames = iter_frames(scalar() if callable(scalar) else scalar)
+    first_frame = next(frames, None)
+    assert first_frame is not None, 'No frames to save'
+    frames = chain([first_frame], frames)
+    n_frames = 0
+
+    with open(f'{save_name}.gif', 'wb') as fp, ThreadPoolExecutor(max_workers = workers) as executor:
+
+        pending = deque()
+        for S_tmp in frames:
+            pending.append(executor.submit(_encode_frame, S_tmp, S_min, S_max, lut, duration, n_frames == 0))
+            n_frames += 1
+
+            # Write in frame order, keeping at most buffer_size frames in flight
+            if len(pending) >= buffer_size:
+                fp.write(pending.popleft().result())
+
+        while pending:
+            fp.write(pending.popleft().result())
+
+        fp.write(b';') # GIF trailer
 
-        S_norm = (S_tmp - S_min) / (S_max - S_min)
-        colored_field = color_vals(S_norm)
-        colored_field_rgb = (colored_field[:, :, :3] * 255).astype('uint8')
-        tmp_image = Image.fromarray(colored_field_rgb)
-        frames.append(tmp_image)
-        
-    frames[0].save(f'{save_name}.gif', save_all=True, append_images=frames[1:], duration=20, loop=0)
     print(f'Saved as: {save_name}.gif')